@@ -0,0 +1,60 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .middleware import active_profiler
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+ASYNC_ROUTES = (
+    'recipe-list', 'recipe-detail', 'tags-list', 'tags-detail',
+    'ingredients-list', 'ingredients-detail', 'subscriptions',
+)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_VIEW_WORKERS, thread_name_prefix='api-read')
+
+
+def run_view(view, request, *args, **kwargs):
+    """Run a sync view in a pool thread, which owns its DB connection."""
+    close_old_connections()
+    profiler = active_profiler.get()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        close_old_connections()
+
+
+def async_read_view(view):
+    """Serve safe requests of a sync view concurrently from the pool.
+
+    Django 3.2 has no async ORM, so the view keeps its sync code and the
+    event loop only waits on it. Writes stay on Django's single thread
+    for sync code, as they would without the wrapper.
+    """
+    @wraps(view)
+    async def handler(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            call = sync_to_async(
+                run_view, thread_sensitive=False, executor=executor)
+        else:
+            call = sync_to_async(run_view)
+        return await call(view, request, *args, **kwargs)
+    return handler
+
+
+def make_async(patterns, names=ASYNC_ROUTES):
+    """Replace callbacks of the named url patterns with async views."""
+    for pattern in patterns:
+        if getattr(pattern, 'name', None) in names:
+            pattern.callback = async_read_view(pattern.callback)
+    return patterns
@@ -0,0 +1,33 @@
+from recipe.models import Ingredients
+
+from .harness import Scenario
+
+
+def get_scenarios(seed):
+    """Ingredient search by prefix and the full tag and ingredient lists."""
+    names = list(Ingredients.objects.values_list('name', flat=True))
+    prefixes = [name[:3] for name in seed.rng.sample(
+        names, min(20, len(names)))]
+    return [
+        Scenario('ingredients-search', 'get', lambda index: (
+            f'/api/ingredients/?name={prefixes[index % len(prefixes)]}')),
+        # ?search= is the SearchFilter icontains query the index
+        # replaced, run over the same prefixes and the whole table.
+        Scenario('ingredients-search-orm', 'get', lambda index: (
+            f'/api/ingredients/?search={prefixes[index % len(prefixes)]}')),
+        Scenario('ingredients', 'get', '/api/ingredients/'),
+        Scenario('tags', 'get', '/api/tags/'),
+    ]
+
+
+def report(results, write):
+    """Compare the in-memory index with the icontains query."""
+    if not {'ingredients-search', 'ingredients-search-orm'} <= (
+            results.keys()):
+        return
+    index = results['ingredients-search']
+    orm = results['ingredients-search-orm']
+    write(f'ingredient search over {Ingredients.objects.count()} rows: '
+          f'index p50 {index["p50_ms"]:.2f} ms, {index["queries"]} '
+          f'queries; icontains p50 {orm["p50_ms"]:.2f} ms, '
+          f'{orm["queries"]} queries, {orm["sql_ms"]:.2f} ms SQL')
@@ -0,0 +1,157 @@
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock
+
+from django.test import Client
+from foodgram.handlers import StreamingASGIHandler
+
+from .. import urls
+from ..async_views import make_async
+from .harness import latency_summary, response_size
+
+
+@contextmanager
+def served_by(server):
+    """Route the url patterns as the given server type would.
+
+    Under ASGI the read routes become async views, under WSGI they keep
+    their sync views, whatever ASYNC_VIEWS says for this process.
+    """
+    patterns = [pattern for pattern in (*urls.urlpatterns, *urls.router.urls)
+                if hasattr(pattern, 'callback')]
+    callbacks = [pattern.callback for pattern in patterns]
+    for pattern, callback in zip(patterns, callbacks):
+        if asyncio.iscoroutinefunction(callback):
+            pattern.callback = callback.__wrapped__
+    if server == 'asgi':
+        make_async(patterns)
+    try:
+        yield
+    finally:
+        for pattern, callback in zip(patterns, callbacks):
+            pattern.callback = callback
+
+
+async def asgi_get(handler, path, headers):
+    """GET ``path`` from an ASGI app, return the status and body size."""
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'query_string': query.encode(),
+        'headers': [(b'host', b'testserver'), *headers],
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 0),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await handler(scope, receive, send)
+    return messages[0]['status'], sum(
+        len(message.get('body', b'')) for message in messages[1:])
+
+
+def serve_wsgi(scenario, indices, concurrency, authorization):
+    """Threads taking turns on one WSGI handler, one at a time."""
+    indices, take, worker = iter(indices), Lock(), Lock()
+    samples = []
+    headers = {} if scenario.anonymous else {
+        'HTTP_AUTHORIZATION': authorization}
+
+    def client_loop():
+        client = Client(**headers)
+        while True:
+            with take:
+                index = next(indices, None)
+            if index is None:
+                return
+            start = time.perf_counter()
+            with worker:
+                response = client.get(scenario.resolve(scenario.path, index))
+                response_size(response)
+            samples.append(
+                (time.perf_counter() - start, response.status_code))
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        clients = [
+            pool.submit(contextvars.copy_context().run, client_loop)
+            for _ in range(concurrency)
+        ]
+    for client in clients:
+        client.result()
+    return samples
+
+
+def serve_asgi(scenario, indices, concurrency, authorization):
+    """Concurrent clients of one ASGI handler in an event loop."""
+    indices = iter(indices)
+    samples = []
+    headers = [] if scenario.anonymous else [
+        (b'authorization', authorization.encode())]
+    handler = StreamingASGIHandler()
+
+    async def client_loop():
+        for index in indices:
+            start = time.perf_counter()
+            status, _ = await asgi_get(
+                handler, scenario.resolve(scenario.path, index), headers)
+            samples.append((time.perf_counter() - start, status))
+
+    async def clients():
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+
+    asyncio.run(clients())
+    return samples
+
+
+SERVERS = {'wsgi': serve_wsgi, 'asgi': serve_asgi}
+
+
+def run(scenarios, requests, warmup, concurrency, authorization):
+    """Serve every read scenario from a WSGI and an ASGI handler.
+
+    WSGI is one sync worker: clients queue for it, as with a sync
+    gunicorn worker. ASGI is one event loop running the async views
+    of foodgram.asgi.
+    """
+    results = {}
+    for scenario in scenarios:
+        if scenario.method != 'get' or scenario.setup:
+            continue
+        for server, serve in SERVERS.items():
+            with served_by(server):
+                serve(scenario, range(warmup), concurrency, authorization)
+                started = time.perf_counter()
+                samples = serve(scenario, range(requests), concurrency,
+                                authorization)
+                elapsed = time.perf_counter() - started
+            results[f'{scenario.name}-{server}'] = {
+                'requests': len(samples),
+                'errors': sum(status >= 400 for _, status in samples),
+                'throughput': round(len(samples) / elapsed, 2),
+                **latency_summary(
+                    [duration * 1000 for duration, _ in samples]),
+                'wall_s': round(elapsed, 3),
+            }
+    return results
+
+
+def report(results, write):
+    write(f'{"endpoint":<28}{"req/s":>9}{"p50":>9}'
+          f'{"p95":>9}{"p99":>9}{"errors":>8}')
+    for name, result in results.items():
+        write(f'{name:<28}{result["throughput"]:>9}'
+              f'{result["p50_ms"]:>9.2f}{result["p95_ms"]:>9.2f}'
+              f'{result["p99_ms"]:>9.2f}{result["errors"]:>8}')
@@ -0,0 +1,110 @@
+import statistics
+import time
+
+from django.db import connection
+from recipe.models import Recipes, Tag
+from rest_framework.pagination import Cursor
+from users.models import Subscription
+
+from ..pagination import RecipeCursorPagination, recipe_position
+from ..views import RecipeViewSet
+from .harness import Scenario
+
+
+def deep_page_urls(size, page):
+    """Offset and keyset URLs of the same deep feed page."""
+    total = Recipes.objects.count()
+    page = max(min(page, total // size), 1)
+    offset_url = f'/api/recipes/?page={page}&limit={size}'
+    paginator = RecipeCursorPagination()
+    paginator.base_url = f'/api/recipes/?pagination=cursor&limit={size}'
+    if page == 1:
+        return offset_url, paginator.base_url
+    # The cursor of a page is the sort key of the last row before it.
+    before = Recipes.objects.order_by('-pub_date', '-id').only(
+        'id', 'pub_date')[(page - 1) * size - 1]
+    cursor_url = paginator.encode_cursor(
+        Cursor(offset=0, reverse=False, position=recipe_position(before)))
+    return offset_url, cursor_url
+
+
+def get_scenarios(seed):
+    """Recipe feed pages, filters, details and the user's own lists."""
+    recipe_ids = list(Recipes.objects.order_by(
+        '-favorites_count').values_list('id', flat=True)[:50])
+    author = Subscription.objects.filter(
+        user=seed.user).values_list('author_id', flat=True).first()
+    author = author or Recipes.objects.values_list(
+        'author_id', flat=True).first()
+    slugs = list(Tag.objects.values_list('slug', flat=True)[:5])
+    deep_page, deep_cursor = deep_page_urls(6, 1000)
+    return [
+        Scenario('recipes', 'get', '/api/recipes/'),
+        Scenario('recipes-anonymous', 'get', '/api/recipes/',
+                 anonymous=True),
+        Scenario('recipes-page', 'get', '/api/recipes/?page=1&limit=6'),
+        Scenario('recipes-page-deep', 'get', deep_page),
+        Scenario('recipes-cursor', 'get',
+                 '/api/recipes/?pagination=cursor&limit=6'),
+        Scenario('recipes-cursor-deep', 'get', deep_cursor),
+        Scenario('recipes-favorited', 'get', '/api/recipes/?is_favorited=1'),
+        Scenario('recipes-shopping-cart', 'get',
+                 '/api/recipes/?is_in_shopping_cart=1'),
+        Scenario('recipes-author', 'get', f'/api/recipes/?author={author}'),
+        *(Scenario(f'recipes-tags-{count}', 'get', '/api/recipes/?'
+                   + '&'.join(f'tags={slug}' for slug in slugs[:count]))
+          for count in range(1, len(slugs) + 1)),
+        Scenario('recipe-detail', 'get', lambda index: (
+            f'/api/recipes/{recipe_ids[index % len(recipe_ids)]}/')),
+        Scenario('subscriptions', 'get',
+                 '/api/users/subscriptions/?recipes_limit=3'),
+        Scenario('download-shopping-cart', 'get',
+                 '/api/recipes/download_shopping_cart/'),
+    ]
+
+
+def query_plan(queryset):
+    """EXPLAIN output of a queryset, one step per line on SQLite too."""
+    if connection.vendor != 'sqlite':
+        return queryset.explain()
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return '\n'.join(row[-1] for row in cursor.fetchall())
+
+
+def compare_tag_plans(requests, write):
+    """Time COUNT and the first page of the old and new tag filters."""
+    slugs = list(Tag.objects.values_list('slug', flat=True)[:5])
+    recipes = Recipes.objects.order_by('-pub_date', '-id')
+    results = {}
+    write(f'{"tags":<6}{"filter":<8}{"rows":>9}'
+          f'{"count p50":>11}{"page p50":>10}')
+    for count in range(1, len(slugs) + 1):
+        tags = slugs[:count]
+        filters = {
+            'join': recipes.filter(tags__slug__in=tags).distinct(),
+            'exists': RecipeViewSet.filter_tags(recipes, tags),
+        }
+        for name, queryset in filters.items():
+            counts, pages = [], []
+            for _ in range(requests):
+                start = time.perf_counter()
+                rows = queryset.count()
+                middle = time.perf_counter()
+                list(queryset.values_list('id', flat=True)[:6])
+                counts.append((middle - start) * 1000)
+                pages.append((time.perf_counter() - middle) * 1000)
+            result = {
+                'rows': rows,
+                'count_p50_ms': round(statistics.median(counts), 3),
+                'page_p50_ms': round(statistics.median(pages), 3),
+                'plan': query_plan(queryset.values('id')[:6]),
+            }
+            results[f'{count}-{name}'] = result
+            write(f'{count:<6}{name:<8}{rows:>9}'
+                  f'{result["count_p50_ms"]:>11.2f}'
+                  f'{result["page_p50_ms"]:>10.2f}')
+    for name, result in results.items():
+        write(f'\n{name}:\n{result["plan"]}')
+    return results
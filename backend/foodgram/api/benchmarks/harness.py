@@ -0,0 +1,153 @@
+import json
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.client import BOUNDARY, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from recipe.models import Ingredients
+
+from ..middleware import QueryTracker, track_sql
+
+
+@dataclass
+class Scenario:
+    """One benchmarked request with untimed per-iteration hooks."""
+
+    name: str
+    method: str
+    path: object
+    data: object = None
+    setup: object = None
+    teardown: object = None
+    anonymous: bool = False
+    status: int = None
+    multipart: bool = False
+    trace_memory: bool = False
+
+    def resolve(self, value, index):
+        return value(index) if callable(value) else value
+
+
+@dataclass
+class Seed:
+    """Generated data every scenario module builds its requests from."""
+
+    users: object
+    user: object
+    rng: object
+    client: object
+    own_recipe: object
+
+    def ingredients_payload(self, count):
+        ids = list(Ingredients.objects.order_by('?').values_list(
+            'id', flat=True)[:count])
+        return [{'id': pk, 'amount': self.rng.randint(1, 500)} for pk in ids]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(int(round(fraction * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def latency_summary(timings):
+    """Mean and percentiles of request durations in milliseconds."""
+    timings = sorted(timings)
+    return {
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+    }
+
+
+def response_size(response):
+    """Bytes of the body, draining streamed responses."""
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def request_kwargs(scenario, data):
+    """Client arguments sending data as JSON or as a multipart form."""
+    if data is None:
+        return {}
+    if scenario.multipart:
+        data = {**data, 'ingredients': json.dumps(data['ingredients'])}
+        # A pre-encoded body with its own content type, as the client
+        # only encodes data sent with MULTIPART_CONTENT itself.
+        return {'data': encode_multipart(BOUNDARY, data),
+                'content_type': f'multipart/form-data; boundary={BOUNDARY}'}
+    return {'data': json.dumps(data), 'content_type': 'application/json'}
+
+
+class SlowQueries:
+    """Execute wrapper delaying every query, like a remote database."""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.delay)
+        return execute(sql, params, many, context)
+
+
+def run(client, scenario, requests, warmup, cold):
+    """Time ``requests`` runs of a scenario after ``warmup`` untimed ones."""
+    timings, queries, sql, sizes, errors = [], [], [], [], 0
+    peaks = []
+    started = time.perf_counter()
+    elapsed = 0.0
+    for index in range(warmup + requests):
+        if scenario.setup:
+            scenario.setup(index)
+        if cold:
+            cache.clear()
+        path = scenario.resolve(scenario.path, index)
+        data = scenario.resolve(scenario.data, index)
+        kwargs = request_kwargs(scenario, data)
+        # Bodies are encoded above, so only the server side is traced.
+        if scenario.trace_memory:
+            tracemalloc.start()
+        with CaptureQueriesContext(connection) as context, track_sql(
+                QueryTracker()) as tracker:
+            start = time.perf_counter()
+            response = getattr(client, scenario.method)(path, **kwargs)
+            size = response_size(response)
+            duration = time.perf_counter() - start
+        if scenario.trace_memory:
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        # Read before teardown, whose request resets the query log.
+        query_count = len(context.captured_queries)
+        sql_ms = tracker.duration * 1000
+        if scenario.teardown:
+            scenario.teardown(index)
+        if index < warmup:
+            continue
+        elapsed += duration
+        timings.append(duration * 1000)
+        queries.append(query_count)
+        sql.append(sql_ms)
+        sizes.append(size)
+        if scenario.status:
+            errors += response.status_code != scenario.status
+        elif response.status_code >= 400:
+            errors += 1
+    return {
+        'requests': requests,
+        'errors': errors,
+        'status': response.status_code,
+        'throughput': round(requests / elapsed, 2) if elapsed else None,
+        **latency_summary(timings),
+        'queries': max(queries),
+        'sql_ms': round(statistics.mean(sql), 3),
+        'bytes': round(statistics.mean(sizes)),
+        'wall_s': round(time.perf_counter() - started, 3),
+        **({'request_bytes': len(kwargs['data']),
+            'peak_kb': round(max(peaks) / 1024)} if peaks else {}),
+    }
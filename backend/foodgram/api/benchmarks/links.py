@@ -0,0 +1,28 @@
+from recipe.models import Recipes
+
+from .harness import Scenario
+
+
+def get_scenarios(seed):
+    """Adding and removing a recipe the user has not linked yet."""
+    fresh = Recipes.objects.filter(author__in=seed.users).exclude(
+        is_favorited=seed.user).exclude(
+        is_in_shopping_cart=seed.user).exclude(
+        id=seed.own_recipe.id).order_by('-id').first()
+    favorite = f'/api/recipes/{fresh.id}/favorite/'
+    cart = f'/api/recipes/{fresh.id}/shopping_cart/'
+
+    def toggle(method, path):
+        """Untimed request undoing or preparing a link toggle."""
+        return lambda index: getattr(seed.client, method)(path)
+
+    return [
+        Scenario('favorite-add', 'post', favorite,
+                 teardown=toggle('delete', favorite)),
+        Scenario('favorite-remove', 'delete', favorite,
+                 setup=toggle('post', favorite)),
+        Scenario('shopping-cart-add', 'post', cart,
+                 teardown=toggle('delete', cart)),
+        Scenario('shopping-cart-remove', 'delete', cart,
+                 setup=toggle('post', cart)),
+    ]
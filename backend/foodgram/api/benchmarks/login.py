@@ -0,0 +1,30 @@
+from .harness import Scenario
+
+LOGIN_URL = '/api/auth/token/login/'
+
+
+def get_scenarios(seed):
+    """A valid login and the two ways a login is rejected."""
+    return [
+        # generate_dataset gives every user the password "password".
+        Scenario('login', 'post', LOGIN_URL, anonymous=True, data={
+            'email': seed.user.email, 'password': 'password'}),
+        Scenario('login-unknown-email', 'post', LOGIN_URL, anonymous=True,
+                 status=400, data={'email': 'unknown@example.com',
+                                   'password': 'password'}),
+        Scenario('login-malformed', 'post', LOGIN_URL, anonymous=True,
+                 status=400, data={'email': 5, 'password': 'password'}),
+    ]
+
+
+def report(results, write):
+    """Split the mean login time into SQL, hashing and the rest."""
+    if not {'login', 'login-malformed'} <= results.keys():
+        return
+    login = results['login']
+    # A malformed login is rejected before any query or hashing.
+    overhead = results['login-malformed']['mean_ms']
+    hashing = login['mean_ms'] - login['sql_ms'] - overhead
+    write(f'login: {login["throughput"]} logins/s, '
+          f'{login["mean_ms"]:.2f} ms = {login["sql_ms"]:.2f} ms SQL + '
+          f'{hashing:.2f} ms hashing + {overhead:.2f} ms framework')
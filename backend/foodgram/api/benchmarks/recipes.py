@@ -0,0 +1,148 @@
+import base64
+import os
+import time
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+from recipe import thumbnails
+from recipe.models import (IngredientPerRecipe, Recipes,
+                           ShoppingCartIngredient, Tag)
+from recipe.signals import cart_rows_batched
+
+from ..serializers import RecipeUpdateSerializer
+from ..views import RecipeViewSet
+from .harness import Scenario
+
+
+class RecreatingRecipeUpdateSerializer(RecipeUpdateSerializer):
+    """The update before the diff: drop every row and insert them anew."""
+
+    def update_ingredients(self, instance, ingredients_data):
+        users = list(instance.is_in_shopping_cart.values_list(
+            'id', flat=True))
+        totals = ShoppingCartIngredient.objects
+        with cart_rows_batched(instance.id):
+            totals.apply_recipes([instance], users, sign=-1)
+            IngredientPerRecipe.objects.filter(recipe=instance).delete()
+            IngredientPerRecipe.objects.bulk_create(
+                IngredientPerRecipe(recipe=instance,
+                                    ingredient_id=item['id'],
+                                    amount=item['amount'])
+                for item in ingredients_data)
+            totals.apply_recipes([instance], users)
+
+
+def update_serializer(serializer_class):
+    """Untimed hook making the recipe endpoint update with this class."""
+    def setup(index):
+        RecipeViewSet.update_serializer_class = serializer_class
+    return setup
+
+
+def tiny_png():
+    """Base64 data URI of a small PNG used as a recipe image."""
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), '#E26C2D').save(buffer, 'PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+def noise_png(size):
+    """PNG of random pixels, about ``size`` bytes as noise won't compress."""
+    side = int((size / 3) ** 0.5)
+    buffer = BytesIO()
+    Image.frombytes('RGB', (side, side), os.urandom(side * side * 3)).save(
+        buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def create_own_recipe(user):
+    """Recipe of the benchmark user edited by the update scenarios."""
+    recipe = Recipes.objects.create(
+        author=user, name='Benchmark recipe', text='Benchmark',
+        cooking_time=10, image=Recipes.objects.first().image)
+    recipe.tags.set(Tag.objects.all()[:2])
+    return recipe
+
+
+def wait_for_variants(timeout=30):
+    """Let scheduled variants finish before the media directory goes."""
+    deadline = time.monotonic() + timeout
+    while thumbnails.pending and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def get_scenarios(seed):
+    """Creating recipes, uploading large images and editing ingredients."""
+    tag_ids = list(Tag.objects.values_list('id', flat=True)[:2])
+    variants = [seed.ingredients_payload(8) for _ in range(2)]
+    # The same 30 ingredients with every amount changed each time.
+    wide = seed.ingredients_payload(30)
+    wide_variants = [
+        [{**item, 'amount': item['amount'] + offset} for item in wide]
+        for offset in (0, 1)
+    ]
+    image = tiny_png()
+    large = noise_png(5 * 1024 * 1024)
+    large_base64 = ('data:image/png;base64,'
+                    + base64.b64encode(large).decode())
+    path = f'/api/recipes/{seed.own_recipe.id}/'
+
+    def new_recipe(image):
+        return lambda index: {
+            'name': 'Benchmark created',
+            'text': 'Benchmark',
+            'cooking_time': 15,
+            'image': image(),
+            'tags': tag_ids,
+            'ingredients': variants[index % 2],
+        }
+
+    def delete_created(index):
+        Recipes.objects.filter(
+            author=seed.user, name='Benchmark created').delete()
+
+    return [
+        Scenario('recipe-create', 'post', '/api/recipes/',
+                 data=new_recipe(lambda: image), teardown=delete_created),
+        # The same 5 MB PNG as base64 in JSON and as a streamed file.
+        Scenario('upload-5mb-base64', 'post', '/api/recipes/',
+                 data=new_recipe(lambda: large_base64),
+                 teardown=delete_created, trace_memory=True),
+        Scenario('upload-5mb-multipart', 'post', '/api/recipes/',
+                 data=new_recipe(lambda: SimpleUploadedFile(
+                     'large.png', large, 'image/png')),
+                 teardown=delete_created, multipart=True,
+                 trace_memory=True),
+        Scenario('recipe-update', 'patch', path, data=lambda index: {
+            'ingredients': variants[index % 2],
+            'cooking_time': 10 + index % 2,
+        }),
+        Scenario('recipe-update-30', 'patch', path, data=lambda index: {
+            'ingredients': wide_variants[index % 2]}),
+        # The same edit through the old delete-all/recreate update.
+        Scenario('recipe-update-30-old', 'patch', path,
+                 data=lambda index: {
+                     'ingredients': wide_variants[index % 2]},
+                 setup=update_serializer(RecreatingRecipeUpdateSerializer),
+                 teardown=update_serializer(RecipeUpdateSerializer)),
+    ]
+
+
+def report(results, write):
+    """Compare ingredient updates, then base64 and multipart uploads."""
+    if {'recipe-update-30', 'recipe-update-30-old'} <= results.keys():
+        diff = results['recipe-update-30']
+        old = results['recipe-update-30-old']
+        write(f'30-ingredient update: diff p50 {diff["p50_ms"]:.2f} ms, '
+              f'{diff["queries"]} queries, {diff["sql_ms"]:.2f} ms SQL; '
+              f'recreate p50 {old["p50_ms"]:.2f} ms, {old["queries"]} '
+              f'queries, {old["sql_ms"]:.2f} ms SQL')
+    for name in ('upload-5mb-base64', 'upload-5mb-multipart'):
+        result = results.get(name)
+        if result is None:
+            continue
+        write(f'{name}: p50 {result["p50_ms"]:.2f} ms, '
+              f'{result["request_bytes"]} request bytes, '
+              f'peak {result["peak_kb"]} KB allocated')
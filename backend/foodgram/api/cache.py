@@ -0,0 +1,142 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.connection import ConnectionProxy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .metrics import CACHE_REQUESTS, registry
+
+GENERATION_KEY = 'recipes:generation'
+
+# Invalidation counters live in a cache that never evicts them.
+versions = ConnectionProxy(caches, 'versions')
+
+
+def initial_version():
+    """Return the first value of an invalidation counter.
+
+    Taken from the clock, so a lost counter never goes back to a value
+    that entries were cached under.
+    """
+    return time.time_ns()
+
+
+def get_version(key):
+    """Return the current value of an invalidation counter."""
+    return versions.get_or_set(key, initial_version, None)
+
+
+def incr(key):
+    """Increment an invalidation counter, creating it if missing."""
+    try:
+        return versions.incr(key)
+    except ValueError:
+        versions.add(key, initial_version(), None)
+        return versions.incr(key)
+
+
+def get_generation():
+    """Return the current generation of cached recipe responses."""
+    return get_version(GENERATION_KEY)
+
+
+def bump_generation(*args, **kwargs):
+    """Invalidate every cached recipe response once the write commits.
+
+    Bumping earlier would let a concurrent miss cache the pre-commit
+    rows under the new generation.
+    """
+    transaction.on_commit(lambda: incr(GENERATION_KEY))
+
+
+def catalog_key(name):
+    """Return the version key of a catalog."""
+    return f'catalog:{name}:version'
+
+
+def bump_catalog(name):
+    """Invalidate a catalog and the recipe responses on commit.
+
+    For bulk writes, which send no signals. The ingredient search index
+    is rebuilt along with the ingredients catalog.
+    """
+    transaction.on_commit(lambda: incr(catalog_key(name)))
+    bump_generation()
+
+
+def make_key(request, action, pk):
+    """Build a cache key from the action and normalized query params."""
+    params = sorted(
+        (name, sorted(request.query_params.getlist(name)))
+        for name in request.query_params
+    )
+    raw = f'{request.get_host()}|{action}|{pk}|{params}'
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'recipes:{get_generation()}:{digest}'
+
+
+def cached_response(handler, request, *args, **kwargs):
+    """Serve anonymous responses from the cache, filling it on a miss."""
+    if request.user.is_authenticated:
+        return handler(request, *args, **kwargs)
+    key = make_key(request, handler.__name__, kwargs.get('pk'))
+    data = cache.get(key)
+    if data is not None:
+        registry.count(CACHE_REQUESTS, ('recipes', 'hit'))
+        return Response(data)
+    registry.count(CACHE_REQUESTS, ('recipes', 'miss'))
+    response = handler(request, *args, **kwargs)
+    if response.status_code == 200:
+        cache.set(key, response.data, settings.RECIPE_CACHE_TIMEOUT)
+    return response
+
+
+class CatalogCache:
+    """Per-process cache of a serialized catalog, keyed by its version.
+
+    The version lives in the "versions" cache, the rendered bytes in
+    process memory. Workers only notice changes made by other workers
+    when that cache is shared between them, see ``CACHES``.
+    """
+
+    def __init__(self, name, queryset, serializer_class):
+        self.version_key = catalog_key(name)
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self.entry = (None, b'', '')
+
+    def get_version(self):
+        """Return the current catalog version."""
+        return get_version(self.version_key)
+
+    def bump_version(self, *args, **kwargs):
+        """Mark the catalog as changed once the write commits."""
+        transaction.on_commit(lambda: incr(self.version_key))
+
+    def get(self):
+        """Return the rendered catalog and its ETag."""
+        version = self.get_version()
+        cached_version, body, etag = self.entry
+        if cached_version != version:
+            data = self.serializer_class(self.queryset.all(), many=True).data
+            body = JSONRenderer().render(data)
+            etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            self.entry = (version, body, etag)
+        return body, etag
+
+    def response(self, request):
+        """Serve the catalog, answering 304 to a matching If-None-Match."""
+        body, etag = self.get()
+        # Handles lists of tags, weak tags and "*" as RFC 7232 requires.
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = settings.CATALOG_CACHE_CONTROL
+        return response
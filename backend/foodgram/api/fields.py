@@ -0,0 +1,21 @@
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from recipe.thumbnails import image_name
+from rest_framework.fields import ImageField
+
+
+class RecipeImageField(Base64ImageField):
+    """Image stored under its content hash with WebP variants.
+
+    Accepts a base64 string in JSON bodies or a file in multipart ones.
+    Validation only names the file, the serializer stores it on commit.
+    """
+
+    def to_internal_value(self, data):
+        """Validate the image and name it after its content."""
+        if isinstance(data, UploadedFile):
+            file = ImageField.to_internal_value(self, data)
+        else:
+            file = super().to_internal_value(data)
+        file.storage_name = image_name(file)
+        return file
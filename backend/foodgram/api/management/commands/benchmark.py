@@ -0,0 +1,203 @@
+import json
+import platform
+import random
+import tempfile
+import time
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from recipe.models import Recipes
+from rest_framework.authtoken.models import Token
+
+from ...benchmarks import (catalog, concurrency, feed, harness, links, login,
+                           recipes)
+from ...middleware import track_sql
+
+User = get_user_model()
+
+# Scenario modules in run order, each with get_scenarios(seed) and
+# optionally report(results, write) comparing a few of its scenarios.
+SCENARIOS = (feed, catalog, links, recipes, login)
+
+
+class Command(BaseCommand):
+    help = ('Benchmark API endpoints against a database seeded by '
+            'generate_dataset and report latency percentiles, query counts '
+            'and response sizes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Timed requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--user',
+            help='Generated username to authenticate as, defaults to the '
+                 'most followed one with a non-empty shopping cart.')
+        parser.add_argument(
+            '--prefix', default='load',
+            help='Username prefix passed to generate_dataset.')
+        parser.add_argument('--only', nargs='*', default=[],
+                            help='Run endpoints whose name contains any '
+                                 'of the given substrings.')
+        parser.add_argument('--cold', action='store_true',
+                            help='Clear the cache before every request.')
+        parser.add_argument(
+            '--concurrency', type=int, default=0,
+            help='Compare WSGI and ASGI throughput of the read endpoints '
+                 'with this many concurrent clients instead.')
+        parser.add_argument(
+            '--query-latency', type=float, default=0.0,
+            help='Milliseconds added to every SQL query, like a remote '
+                 'database.')
+        parser.add_argument(
+            '--tag-plans', action='store_true',
+            help='Instead, time the tag filter against the old join with '
+                 'distinct() for 1 to 5 tags and print both query plans.')
+        parser.add_argument('--output', help='Write results as JSON.')
+        parser.add_argument(
+            '--compare',
+            help='Baseline JSON to compare p95 latency and query counts.')
+        parser.add_argument(
+            '--threshold', type=float, default=20.0,
+            help='Allowed p95 slowdown in percent before failing.')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1.')
+        # Scenarios write recipes, favorites and carts, so only ever run
+        # against generated data and never touch real users.
+        users = User.objects.filter(username__startswith=options['prefix'])
+        if not users.exists() or not Recipes.objects.filter(
+                author__in=users).exists():
+            raise CommandError(
+                'The database was not seeded by generate_dataset '
+                f'(no recipes of "{options["prefix"]}" users), refusing '
+                'to run against it.')
+        self.user = self.get_user(users, options['user'])
+        if options['tag_plans']:
+            results = feed.compare_tag_plans(
+                options['requests'], self.stdout.write)
+            if options['output']:
+                with open(options['output'], 'w') as file:
+                    json.dump({'meta': self.get_meta(options),
+                               'tag_plans': results}, file, indent=2)
+            return
+        token, created = Token.objects.get_or_create(user=self.user)
+        authorization = f'Token {token.key}'
+        client = Client(HTTP_AUTHORIZATION=authorization)
+        anonymous = Client()
+
+        with tempfile.TemporaryDirectory() as media, override_settings(
+                ALLOWED_HOSTS=['testserver'], MEDIA_ROOT=media), track_sql(
+                harness.SlowQueries(options['query_latency'] / 1000)):
+            seed = harness.Seed(
+                users=users, user=self.user,
+                rng=random.Random(options['seed']), client=client,
+                own_recipe=recipes.create_own_recipe(self.user))
+            try:
+                scenarios = [
+                    scenario for module in SCENARIOS
+                    for scenario in module.get_scenarios(seed)
+                    if not options['only'] or any(
+                        part in scenario.name for part in options['only'])
+                ]
+                if options['concurrency']:
+                    results = concurrency.run(
+                        scenarios, options['requests'], options['warmup'],
+                        options['concurrency'], authorization)
+                else:
+                    results = {
+                        scenario.name: harness.run(
+                            anonymous if scenario.anonymous else client,
+                            scenario, options['requests'],
+                            options['warmup'], options['cold'])
+                        for scenario in scenarios
+                    }
+            finally:
+                Recipes.objects.filter(
+                    author=self.user, name__startswith='Benchmark').delete()
+                if created:
+                    token.delete()
+                recipes.wait_for_variants()
+
+        report = {'meta': self.get_meta(options), 'endpoints': results}
+        if options['concurrency']:
+            concurrency.report(results, self.stdout.write)
+        else:
+            self.print_report(results)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2, ensure_ascii=False)
+        if options['compare']:
+            self.compare(results, options['compare'], options['threshold'])
+
+    def get_user(self, users, username):
+        if username:
+            try:
+                return users.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(
+                    f'Generated user "{username}" does not exist.')
+        user = users.filter(
+            shopping_cart__isnull=False,
+        ).order_by('-stats__followers_count', 'id').first()
+        return user or users.order_by('id').first()
+
+    def get_meta(self, options):
+        return {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'cache': cache.__class__.__name__,
+            'cold_cache': options['cold'],
+            'concurrency': options['concurrency'],
+            'query_latency_ms': options['query_latency'],
+            'user': self.user.username,
+            'recipes': Recipes.objects.count(),
+            'users': User.objects.count(),
+        }
+
+    def print_report(self, results):
+        header = (f'{"endpoint":<24}{"req/s":>9}{"p50":>9}{"p95":>9}'
+                  f'{"p99":>9}{"queries":>9}{"sql":>9}{"bytes":>10}'
+                  f'{"errors":>8}')
+        self.stdout.write(header)
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<24}{result["throughput"]:>9}'
+                f'{result["p50_ms"]:>9.2f}{result["p95_ms"]:>9.2f}'
+                f'{result["p99_ms"]:>9.2f}{result["queries"]:>9}'
+                f'{result["sql_ms"]:>9.2f}{result["bytes"]:>10}'
+                f'{result["errors"]:>8}')
+        for module in SCENARIOS:
+            if hasattr(module, 'report'):
+                module.report(results, self.stdout.write)
+
+    def compare(self, results, path, threshold):
+        with open(path) as file:
+            baseline = json.load(file)['endpoints']
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            change = (result['p95_ms'] / before['p95_ms'] - 1) * 100
+            # Concurrency runs do not count queries.
+            queries = before.get('queries'), result.get('queries')
+            if change > threshold or (
+                    None not in queries and queries[1] > queries[0]):
+                regressions.append(name)
+            line = (f'{name:<24}p95 {before["p95_ms"]:.2f} -> '
+                    f'{result["p95_ms"]:.2f} ms ({change:+.1f}%)')
+            if None not in queries:
+                line += f', queries {queries[0]} -> {queries[1]}'
+            self.stdout.write(line)
+        if regressions:
+            raise CommandError('Regressed: ' + ', '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.utils.http import urlencode
+
+from ...middleware import PROFILE_PARAM, sign_profile_path
+
+
+class Command(BaseCommand):
+    help = 'Print a signed URL that profiles one request to the given path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path such as /api/recipes/.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        query = urlencode({PROFILE_PARAM: sign_profile_path(path)})
+        self.stdout.write(f'{path}?{query}')
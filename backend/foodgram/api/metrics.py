@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000)
+
+METRICS = {
+    'foodgram_http_request_duration_seconds': (
+        'Time spent serving the request.', DURATION_BUCKETS),
+    'foodgram_http_db_queries': (
+        'SQL queries issued by the request.', QUERY_BUCKETS),
+    'foodgram_http_db_duration_seconds': (
+        'Time spent in SQL queries by the request.', DURATION_BUCKETS),
+    'foodgram_http_response_size_bytes': (
+        'Size of the response body.', SIZE_BUCKETS),
+}
+
+LABELS = ('route', 'method', 'status')
+
+CACHE_REQUESTS = 'foodgram_cache_requests_total'
+
+COUNTERS = {
+    CACHE_REQUESTS: (
+        'Cache lookups by cache and result.', ('cache', 'result')),
+}
+
+
+class Registry:
+    """Per-process metrics, optionally shared through a directory.
+
+    Every worker owns one file in ``METRICS_DIR`` and rewrites it at most
+    every ``METRICS_FLUSH_INTERVAL`` seconds, so workers never write to
+    the same file and a scrape merges all of them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.samples = {}
+        self.counters = {}
+        self.flushed = 0
+
+    @property
+    def directory(self):
+        return getattr(settings, 'METRICS_DIR', None)
+
+    def check_pid(self):
+        """Drop the parent's samples after a fork, the lock must be held."""
+        if os.getpid() != self.pid:
+            self.reset()
+
+    def maybe_flush(self):
+        """Flush when the interval passed, the lock must be held."""
+        if self.directory and time.monotonic() - self.flushed > getattr(
+                settings, 'METRICS_FLUSH_INTERVAL', 5):
+            self.flush()
+
+    def observe(self, labels, values):
+        """Add one request, ``values`` maps metric names to amounts."""
+        with self.lock:
+            self.check_pid()
+            for metric, value in values.items():
+                buckets = METRICS[metric][1]
+                sample = self.samples.setdefault(
+                    (metric, labels), [[0] * (len(buckets) + 1), 0])
+                index = next(
+                    (index for index, bound in enumerate(buckets)
+                     if value <= bound), len(buckets))
+                sample[0][index] += 1
+                sample[1] += value
+            self.maybe_flush()
+
+    def count(self, metric, labels, amount=1):
+        """Increment a counter by ``amount``."""
+        with self.lock:
+            self.check_pid()
+            key = (metric, labels)
+            self.counters[key] = self.counters.get(key, 0) + amount
+            self.maybe_flush()
+
+    def flush(self):
+        """Atomically rewrite this worker's file, the lock must be held."""
+        directory = Path(self.directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'worker-{self.pid}.json'
+        temporary = path.with_suffix('.tmp')
+        temporary.write_text(json.dumps({
+            'histograms': [
+                [metric, labels, counts, total]
+                for (metric, labels), (counts, total) in self.samples.items()
+            ],
+            'counters': [
+                [metric, labels, value]
+                for (metric, labels), value in self.counters.items()
+            ],
+        }))
+        os.replace(temporary, path)
+        self.flushed = time.monotonic()
+
+    def collect(self):
+        """Return histograms and counters of every worker, merged."""
+        with self.lock:
+            if not self.directory:
+                return ({key: [list(counts), total]
+                         for key, (counts, total) in self.samples.items()},
+                        dict(self.counters))
+            self.flush()
+        merged = {}
+        counters = {}
+        for path in Path(self.directory).glob('worker-*.json'):
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            for metric, labels, counts, total in data['histograms']:
+                if metric not in METRICS:
+                    continue
+                sample = merged.setdefault(
+                    (metric, tuple(labels)), [[0] * len(counts), 0])
+                sample[0] = [a + b for a, b in zip(sample[0], counts)]
+                sample[1] += total
+            for metric, labels, value in data['counters']:
+                if metric not in COUNTERS:
+                    continue
+                key = (metric, tuple(labels))
+                counters[key] = counters.get(key, 0) + value
+        return merged, counters
+
+
+registry = Registry()
+
+
+def escape(value):
+    return (str(value).replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def format_labels(labels, names=LABELS, **extra):
+    pairs = list(zip(names, labels)) + list(extra.items())
+    return ','.join(f'{name}="{escape(value)}"' for name, value in pairs)
+
+
+def render():
+    """Render every metric in the Prometheus text exposition format."""
+    samples, counters = registry.collect()
+    lines = []
+    for metric, (help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        for (name, labels), (counts, total) in sorted(samples.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(
+                    f'{metric}_bucket{{{format_labels(labels, le=bound)}}} '
+                    f'{cumulative}')
+            lines.append(f'{metric}_sum{{{format_labels(labels)}}} {total}')
+            lines.append(
+                f'{metric}_count{{{format_labels(labels)}}} {cumulative}')
+    for metric, (help_text, names) in COUNTERS.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} counter')
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(
+                    f'{metric}{{{format_labels(labels, names)}}} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,260 @@
+import asyncio
+import cProfile
+import json
+import os
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.exceptions import AuthenticationFailed
+from users.authentication import CachedTokenAuthentication
+
+from .metrics import registry
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = 'profile'
+PROFILE_SALT = 'api.profile'
+
+# Execute wrappers of the current request. A context variable follows the
+# request into the threads sync_to_async() runs its views in, unlike
+# connection.execute_wrapper() which only sees the calling thread.
+sql_wrappers = ContextVar('sql_wrappers', default=())
+# Profiler the async views enable in the thread they run in.
+active_profiler = ContextVar('active_profiler', default=None)
+
+
+def dispatch_sql(execute, sql, params, many, context):
+    """Pass a statement through the execute wrappers of the request."""
+    for wrapper in reversed(sql_wrappers.get()):
+        execute = partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+def install_sql_dispatcher(sender, connection, **kwargs):
+    """Attach dispatch_sql() to every new database connection."""
+    if dispatch_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(dispatch_sql)
+
+
+@contextmanager
+def track_sql(wrapper):
+    """Send the statements of the current request through ``wrapper``."""
+    token = sql_wrappers.set(sql_wrappers.get() + (wrapper,))
+    try:
+        yield wrapper
+    finally:
+        sql_wrappers.reset(token)
+
+
+def sign_profile_path(path):
+    """Return the query param value that profiles requests to ``path``."""
+    return signing.TimestampSigner(salt=PROFILE_SALT).sign(path)
+
+
+class QueryTracker:
+    """Execute wrapper counting SQL statements and their total time."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """Record latency, SQL usage and response size per resolved route."""
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with track_sql(QueryTracker()) as tracker:
+            response = self.get_response(request)
+        return self.finish(request, response, tracker, start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with track_sql(QueryTracker()) as tracker:
+            response = await self.get_response(request)
+        return self.finish(request, response, tracker, start)
+
+    def finish(self, request, response, tracker, start):
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, request, response, tracker,
+                start)
+        else:
+            self.record(request, response, tracker, start,
+                        len(response.content))
+        return response
+
+    def stream(self, content, request, response, tracker, start):
+        """Finish measuring once a streamed body has been sent."""
+        size = 0
+        try:
+            with track_sql(tracker):
+                for chunk in content:
+                    size += len(chunk)
+                    yield chunk
+        finally:
+            self.record(request, response, tracker, start, size)
+
+    def record(self, request, response, tracker, start, size):
+        match = request.resolver_match
+        route = 'unmatched'
+        if match is not None:
+            route = match.url_name or match.route or 'unnamed'
+        registry.observe(
+            (route, request.method, str(response.status_code)),
+            {
+                'foodgram_http_request_duration_seconds':
+                    time.perf_counter() - start,
+                'foodgram_http_db_queries': tracker.count,
+                'foodgram_http_db_duration_seconds': tracker.duration,
+                'foodgram_http_response_size_bytes': size,
+            },
+        )
+
+
+class SQLTrace:
+    """Execute wrapper keeping every statement with its project origin."""
+
+    def __init__(self):
+        self.root = os.path.join(str(settings.BASE_DIR), '')
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.statements.append({
+                'sql': sql,
+                'params': repr(params)[:500],
+                'many': many,
+                'duration_ms': (time.perf_counter() - start) * 1000,
+                'origin': self.origin(),
+            })
+
+    def origin(self):
+        """Innermost project frames that led to the statement."""
+        frames = [
+            f'{os.path.relpath(frame.filename, self.root)}:{frame.lineno} '
+            f'in {frame.name}'
+            for frame in traceback.extract_stack()[:-2]
+            if frame.filename.startswith(self.root)
+            and frame.filename != __file__
+        ]
+        return frames[:-6:-1]
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """Run single requests under cProfile when a staff user asks for it.
+
+    A request is profiled when it carries an ``X-Profile`` header from a
+    staff user or a ``profile`` query param signed for its path (see the
+    profile_url command). The ``.prof`` file and a JSON SQL trace are
+    written to ``PROFILE_DIR``; without it the hook is disabled. Under
+    ASGI only views served by api.async_views are profiled.
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.requested(request) or not self.allowed(request):
+            return self.get_response(request)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        with track_sql(SQLTrace()) as trace:
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+                if response.streaming:
+                    response.streaming_content = list(
+                        response.streaming_content)
+            finally:
+                profiler.disable()
+        return self.save(request, response, profiler, trace, start)
+
+    async def __acall__(self, request):
+        if not self.requested(request) or not await sync_to_async(
+                self.allowed)(request):
+            return await self.get_response(request)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        token = active_profiler.set(profiler)
+        try:
+            with track_sql(SQLTrace()) as trace:
+                response = await self.get_response(request)
+                if response.streaming:
+                    response.streaming_content = await sync_to_async(list)(
+                        response.streaming_content)
+        finally:
+            active_profiler.reset(token)
+        return await sync_to_async(self.save)(
+            request, response, profiler, trace, start)
+
+    def requested(self, request):
+        return settings.PROFILE_DIR and (
+            PROFILE_HEADER in request.META or PROFILE_PARAM in request.GET)
+
+    def allowed(self, request):
+        signature = request.GET.get(PROFILE_PARAM)
+        if signature:
+            try:
+                path = signing.TimestampSigner(salt=PROFILE_SALT).unsign(
+                    signature, max_age=settings.PROFILE_SIGNATURE_MAX_AGE)
+            except signing.BadSignature:
+                return False
+            return path == request.path
+        if request.user.is_staff:
+            return True
+        try:
+            credentials = CachedTokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        return credentials is not None and credentials[0].is_staff
+
+    def save(self, request, response, profiler, trace, start):
+        """Write the profile and the SQL trace, naming them in a header."""
+        duration = (time.perf_counter() - start) * 1000
+        name = '-'.join([
+            time.strftime('%Y%m%d-%H%M%S'),
+            request.path.strip('/').replace('/', '_') or 'root',
+            uuid4().hex[:8],
+        ])
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        base = os.path.join(settings.PROFILE_DIR, name)
+        profiler.dump_stats(f'{base}.prof')
+        repeated = Counter(item['sql'] for item in trace.statements)
+        with open(f'{base}.json', 'w') as file:
+            json.dump({
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'duration_ms': duration,
+                'query_count': len(trace.statements),
+                'sql_ms': sum(
+                    item['duration_ms'] for item in trace.statements),
+                'repeated': [
+                    {'sql': sql, 'count': count}
+                    for sql, count in repeated.most_common() if count > 1
+                ],
+                'statements': trace.statements,
+            }, file, indent=2)
+        response['X-Profile-Id'] = name
+        return response
@@ -1,9 +1,118 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 from foodgram.settings import RESULTS_PER_PAGE
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+def recipe_position(recipe):
+    """Cursor position of a recipe: its unique (pub_date, id) pair."""
+    return f'{recipe.pub_date.isoformat()}|{recipe.pk}'
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Keyset pagination over the recipe feed.
+
+    DRF's cursor encodes only the first ordering field and steps over
+    ties with an offset. Here the position is the (pub_date, id) pair,
+    so recipes sharing a pub_date are paged by keyset as well and rows
+    inserted meanwhile are neither skipped nor repeated.
+    """
+
+    page_size = RESULTS_PER_PAGE
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """DRF's cursor pagination with a filter on both sort keys."""
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, position = 0, False, None
+        else:
+            offset, reverse, position = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by('pub_date', 'id')
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            pub_date, pk = self.parse_position(position)
+            lookup = 'gt' if reverse else 'lt'
+            queryset = queryset.filter(
+                Q(**{f'pub_date__{lookup}': pub_date})
+                | Q(pub_date=pub_date, **{f'id__{lookup}': pk}))
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = None
+        if len(results) > len(self.page):
+            following = recipe_position(results[-1])
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None or offset > 0
+            self.has_previous = following is not None
+            self.next_position = position
+            self.previous_position = following
+        else:
+            self.has_next = following is not None
+            self.has_previous = position is not None or offset > 0
+            self.next_position = following
+            self.previous_position = position
+        if self.has_previous or self.has_next:
+            self.display_page_controls = True
+        return self.page
+
+    def parse_position(self, position):
+        pub_date, _, pk = position.rpartition('|')
+        try:
+            pub_date = parse_datetime(pub_date)
+            pk = int(pk)
+        except ValueError:
+            pub_date = None
+        if pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return pub_date, pk
+
+    def _get_position_from_instance(self, instance, ordering):
+        return recipe_position(instance)
 
 
 class RecipePagination(PageNumberPagination):
-    """Pagination for the project."""
+    """Pagination for the project.
+
+    Page-number based by default; ``?pagination=cursor`` (or a ``cursor``
+    from a previous response) switches to keyset pagination.
+    """
 
     page_size = RESULTS_PER_PAGE
     page_size_query_param = "limit"
+    cursor_pagination_class = RecipeCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Delegate to the cursor paginator when it is requested."""
+        self.cursor_paginator = None
+        if (request.query_params.get('pagination') == 'cursor'
+                or RecipeCursorPagination.cursor_query_param
+                in request.query_params):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        """Build the response of the paginator that handled the page."""
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class SubscriptionPagination(PageNumberPagination):
+    """Page-number pagination for followed authors."""
+
+    page_size = RESULTS_PER_PAGE
+    page_size_query_param = 'limit'
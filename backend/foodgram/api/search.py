@@ -0,0 +1,58 @@
+from bisect import bisect_left
+
+from django.conf import settings
+from recipe.models import Ingredients
+
+
+def normalize(value):
+    """Normalize a name for matching."""
+    return value.lower().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """Sorted in-memory index of ingredient names for autocomplete.
+
+    The index is rebuilt whenever the version of the ingredient catalog
+    changes. Version, keys and rows are swapped as one tuple so that
+    concurrent searches never pair keys with rows of another build.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.index = (None, [], [])
+
+    def refresh(self):
+        """Return the current index, rebuilding it if the catalog changed."""
+        version = self.catalog.get_version()
+        index = self.index
+        if version == index[0]:
+            return index
+        entries = sorted(
+            (normalize(row['name']), row['id'], row)
+            for row in Ingredients.objects.values(
+                'id', 'name', 'measurement_unit')
+        )
+        index = (version, [key for key, _, _ in entries],
+                 [row for _, _, row in entries])
+        self.index = index
+        return index
+
+    def search(self, query, limit=None):
+        """Return prefix matches first, then substring matches."""
+        _, keys, rows = self.refresh()
+        limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+        query = normalize(query.strip())
+        start = bisect_left(keys, query)
+        end = start
+        while end < len(keys) and end - start < limit:
+            if not keys[end].startswith(query):
+                break
+            end += 1
+        results = rows[start:end]
+        if len(results) < limit:
+            for position, key in enumerate(keys):
+                if query in key and not key.startswith(query):
+                    results.append(rows[position])
+                    if len(results) == limit:
+                        break
+        return results
@@ -1,10 +1,20 @@
+import json
+from functools import partial
+
 from django.contrib.auth import get_user_model
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import QueryDict
 from drf_extra_fields.fields import Base64ImageField
-from recipe.models import IngredientPerRecipe, Ingredients, Recipes, Tag
+from recipe.models import (IngredientPerRecipe, Ingredients, Recipes,
+                           ShoppingCartIngredient, Tag)
+from recipe.signals import cart_rows_batched
+from recipe.thumbnails import store_image, variant_names
 from rest_framework import serializers
+from users.models import Subscription
 from users.serializers import UserSerializer
 
+from .fields import RecipeImageField
 from .validators import max_integer_field_validator, positive_value_validator
 
 User = get_user_model()
@@ -73,7 +83,7 @@ class RecipeUpdateSerializer(serializers.ModelSerializer):
         required=False,
     )
     ingredients = IngredientRecipeCreateSerializer(many=True)
-    image = Base64ImageField()
+    image = RecipeImageField()
     name = serializers.CharField()
     text = serializers.CharField()
     cooking_time = serializers.IntegerField(
@@ -84,62 +94,131 @@ class RecipeUpdateSerializer(serializers.ModelSerializer):
         fields = ['author', 'tags', 'ingredients',
                   'image', 'name', 'text', 'cooking_time']
 
+    def to_internal_value(self, data):
+        """Unpack the JSON-encoded ingredients of multipart requests."""
+        if isinstance(data, QueryDict):
+            unpacked = data.dict()
+            if 'tags' in data:
+                unpacked['tags'] = data.getlist('tags')
+            if isinstance(unpacked.get('ingredients'), str):
+                try:
+                    unpacked['ingredients'] = json.loads(
+                        unpacked['ingredients'])
+                except ValueError:
+                    raise serializers.ValidationError(
+                        {'ingredients': ['Expected a JSON list.']})
+            data = unpacked
+        return super().to_internal_value(data)
+
+    def validate_ingredients(self, value):
+        """Check that every ingredient exists and is listed only once."""
+        ids = [ingredient['id'] for ingredient in value]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError(
+                'Ingredients should not be repeated.')
+        missing = set(ids) - Ingredients.objects.in_bulk(ids).keys()
+        if missing:
+            raise serializers.ValidationError(
+                'Unknown ingredients: '
+                + ', '.join(str(pk) for pk in sorted(missing)))
+        return value
+
+    @transaction.atomic
     def create(self, validated_data):
         """Handle creation of new recipes."""
         ingredients_data = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
+        tags = validated_data.pop('tags', [])
+        self.defer_image(validated_data)
         recipe = Recipes.objects.create(**validated_data)
-        ingredient_per_recipe_list = []
-        for ingredient_data in ingredients_data:
-
-            ingredient = ingredient_data.get('id')
-            amount = ingredient_data.get('amount')
-            ingredient_id = Ingredients.objects.get(id=ingredient)
-            ingredient_per_recipe = IngredientPerRecipe(
-                recipe=recipe, ingredient=ingredient_id, amount=amount)
-            ingredient_per_recipe_list.append(ingredient_per_recipe)
-        IngredientPerRecipe.objects.bulk_create(ingredient_per_recipe_list)
-
+        IngredientPerRecipe.objects.bulk_create(
+            IngredientPerRecipe(recipe=recipe,
+                                ingredient_id=ingredient['id'],
+                                amount=ingredient['amount'])
+            for ingredient in ingredients_data
+        )
         recipe.tags.set(tags)
-        recipe.save()
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         """Handle updates of existing recipes."""
-        instance.image = validated_data.get('image', instance.image)
-        instance.name = validated_data.get('name', instance.name)
-        instance.text = validated_data.get('text', instance.text)
-        instance.cooking_time = validated_data.get(
-            'cooking_time', instance.cooking_time
-        )
-        tags_data = validated_data.pop('tags')
-        ingredients_data = validated_data.pop('ingredients')
-        instance.tags.clear()
-        instance.ingredients.clear()
-
-        tags_list = []
-
-        for tag in tags_data:
-            tags_list.append(tag)
-        instance.tags.set(tags_list)
-
-        ingredients_list = []
-
-        for ingredient in ingredients_data:
-            ingredient_id = ingredient.get('id')
-            amount = ingredient.get('amount')
-            ingredient_object = get_object_or_404(
-                Ingredients, id=ingredient_id)
-            ingredient_instance = IngredientPerRecipe(
-                recipe=instance, ingredient=ingredient_object, amount=amount)
-            ingredients_list.append(ingredient_instance)
-        IngredientPerRecipe.objects.bulk_create(ingredients_list)
-
-        instance.save()
+        self.defer_image(validated_data)
+        update_fields = [
+            field for field in ('image', 'name', 'text', 'cooking_time')
+            if field in validated_data
+        ]
+        for field in update_fields:
+            setattr(instance, field, validated_data[field])
+        if 'image' in update_fields:
+            # store_image flags the new image once its variants exist.
+            instance.image_variants_ready = False
+            update_fields.append('image_variants_ready')
+        if update_fields:
+            instance.save(update_fields=update_fields)
+        tags_data = validated_data.pop('tags', None)
+        if tags_data is not None:
+            instance.tags.set(tags_data)
+        ingredients_data = validated_data.pop('ingredients', None)
+        if ingredients_data is not None:
+            self.update_ingredients(instance, ingredients_data)
         return instance
 
+    @staticmethod
+    def defer_image(validated_data):
+        """Replace the upload with its name, storing it on commit."""
+        file = validated_data.get('image')
+        if file is not None:
+            validated_data['image'] = file.storage_name
+            transaction.on_commit(
+                partial(store_image, file.storage_name, file))
+
+    def update_ingredients(self, instance, ingredients_data):
+        """Apply only the changed rows, moving cart totals once."""
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients_data
+        }
+        existing = {
+            row.ingredient_id: row
+            for row in IngredientPerRecipe.objects.filter(recipe=instance)
+        }
+        to_delete = [
+            row.id for ingredient_id, row in existing.items()
+            if ingredient_id not in amounts
+        ]
+        to_update = []
+        for ingredient_id, row in existing.items():
+            amount = amounts.get(ingredient_id, row.amount)
+            if row.amount != amount:
+                row.amount = amount
+                to_update.append(row)
+        to_create = [
+            IngredientPerRecipe(
+                recipe=instance, ingredient_id=ingredient_id, amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ]
+        if not (to_delete or to_update or to_create):
+            return
+        users = list(instance.is_in_shopping_cart.values_list(
+            'id', flat=True))
+        totals = ShoppingCartIngredient.objects
+        with cart_rows_batched(instance.id):
+            totals.apply_recipes([instance], users, sign=-1)
+            if to_delete:
+                IngredientPerRecipe.objects.filter(id__in=to_delete).delete()
+            IngredientPerRecipe.objects.bulk_update(to_update, ['amount'])
+            IngredientPerRecipe.objects.bulk_create(to_create)
+            totals.apply_recipes([instance], users)
+
     def to_representation(self, instance):
         """Handle API response after successful operation."""
+        prefetch_related_objects(
+            [instance], 'tags', Prefetch(
+                'ingredientperrecipe_set',
+                queryset=IngredientPerRecipe.objects.select_related(
+                    'ingredient'),
+            ))
         serializer = RecipeSerializer(
             instance,
             context=self.context
@@ -158,20 +237,45 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    image_variants = serializers.SerializerMethodField()
 
     def get_is_favorited(self, obj):
         """Handle showing if recipe is in favorites."""
+        if not isinstance(obj, Recipes):
+            return False
+        if hasattr(obj, 'favorited'):
+            return obj.favorited
         user = self.context['request'].user
-        if isinstance(obj, Recipes):
-            return obj.is_favorited.filter(id=user.id).exists()
-        return False
+        if not user.is_authenticated:
+            return False
+        return obj.is_favorited.filter(id=user.id).exists()
 
     def get_is_in_shopping_cart(self, obj):
         """Handle showing if the recipe is in the shopping cart."""
+        if not isinstance(obj, Recipes):
+            return False
+        if hasattr(obj, 'in_shopping_cart'):
+            return obj.in_shopping_cart
         user = self.context['request'].user
-        if isinstance(obj, Recipes):
-            return obj.is_in_shopping_cart.filter(id=user.id).exists()
-        return False
+        if not user.is_authenticated:
+            return False
+        return obj.is_in_shopping_cart.filter(id=user.id).exists()
+
+    def get_image_variants(self, obj):
+        """Return absolute urls of the WebP variants of the image.
+
+        Until the workers rendered them every variant is the original.
+        """
+        if not obj.image:
+            return None
+        request = self.context['request']
+        names = variant_names(obj.image.name)
+        if not obj.image_variants_ready:
+            names = dict.fromkeys(names, obj.image.name)
+        return {
+            variant: request.build_absolute_uri(obj.image.storage.url(name))
+            for variant, name in names.items()
+        }
 
     def get_image(self, obj):
         """Return absolute image's url in the API response."""
@@ -183,4 +287,59 @@ class RecipeSerializer(serializers.ModelSerializer):
         model = Recipes
         fields = ['id', 'tags', 'author', 'ingredients', 'is_favorited',
                   'is_in_shopping_cart', 'name',
-                  'image', 'text', 'cooking_time']
+                  'image', 'image_variants', 'text', 'cooking_time']
+
+
+class RecipeShortSerializer(serializers.ModelSerializer):
+    """Serializer for the short form of recipes."""
+
+    image = serializers.ImageField(read_only=True)
+
+    class Meta:
+        model = Recipes
+        fields = ['id', 'name', 'image', 'cooking_time']
+
+
+class RecipeBulkSerializer(serializers.Serializer):
+    """Serializer for lists of recipe ids in bulk requests."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+    def validate_recipes(self, value):
+        """Resolve the ids into recipes in one query."""
+        recipes = Recipes.objects.only(
+            'id', 'name', 'image', 'cooking_time').in_bulk(value)
+        missing = set(value) - recipes.keys()
+        if missing:
+            raise serializers.ValidationError(
+                'Unknown recipes: '
+                + ', '.join(str(pk) for pk in sorted(missing)))
+        return list(recipes.values())
+
+
+class SubscriptionSerializer(serializers.ModelSerializer):
+    """Serializer for followed authors along with their recipes."""
+
+    email = serializers.ReadOnlyField(source='author.email')
+    id = serializers.ReadOnlyField(source='author.id')
+    username = serializers.ReadOnlyField(source='author.username')
+    first_name = serializers.ReadOnlyField(source='author.first_name')
+    last_name = serializers.ReadOnlyField(source='author.last_name')
+    is_subscribed = serializers.SerializerMethodField()
+    recipes = RecipeShortSerializer(
+        source='author.recipes', many=True, read_only=True)
+    recipes_count = serializers.ReadOnlyField(
+        source='author.stats.recipes_count')
+
+    class Meta:
+        model = Subscription
+        fields = ['email', 'id', 'username', 'first_name', 'last_name',
+                  'is_subscribed', 'recipes', 'recipes_count']
+
+    def get_is_subscribed(self, obj):
+        """Followed authors are subscribed to by definition."""
+        return True
@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from recipe.models import IngredientPerRecipe, Ingredients, Recipes, Tag
+
+from .cache import bump_generation
+from .middleware import install_sql_dispatcher
+from .views import IngredientViewSet, TagViewSet
+
+User = get_user_model()
+
+for model in (Recipes, IngredientPerRecipe, Ingredients, Tag, User):
+    post_save.connect(bump_generation, sender=model,
+                      dispatch_uid=f'recipes_cache_save_{model.__name__}')
+    post_delete.connect(bump_generation, sender=model,
+                        dispatch_uid=f'recipes_cache_delete_{model.__name__}')
+
+m2m_changed.connect(bump_generation, sender=Recipes.tags.through,
+                    dispatch_uid='recipes_cache_tags')
+
+for model, catalog in ((Ingredients, IngredientViewSet.catalog),
+                       (Tag, TagViewSet.catalog)):
+    post_save.connect(catalog.bump_version, sender=model,
+                      dispatch_uid=f'catalog_save_{model.__name__}')
+    post_delete.connect(catalog.bump_version, sender=model,
+                        dispatch_uid=f'catalog_delete_{model.__name__}')
+
+connection_created.connect(install_sql_dispatcher,
+                           dispatch_uid='api_sql_dispatcher')
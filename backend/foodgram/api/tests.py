@@ -0,0 +1,973 @@
+import base64
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from itertools import product
+from threading import BoundedSemaphore
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError
+from django.db.models import Count, F
+from django.http.multipartparser import MultiPartParser, MultiPartParserError
+from django.test import (RequestFactory, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import resolve
+from django.utils import timezone
+from foodgram import handlers
+from foodgram.handlers import StreamingASGIHandler
+from PIL import Image
+from recipe import thumbnails
+from recipe.management.commands import load_ingredients
+from recipe.models import (IngredientPerRecipe, Ingredients, Recipes,
+                           ShoppingCartIngredient, Tag)
+from recipe.signals import batched_recipes, delete_recipe
+from rest_framework.authtoken.models import Token
+from rest_framework.test import (APIClient, APIRequestFactory,
+                                 force_authenticate)
+from users.authentication import local_tokens
+from users.models import Subscription
+
+from . import metrics
+from .async_views import async_read_view
+from .cache import (GENERATION_KEY, catalog_key, get_generation, get_version,
+                    versions)
+from .middleware import sign_profile_path
+from .serializers import RecipeUpdateSerializer
+from .uploads import SizeLimitUploadHandler
+from .views import RecipeViewSet
+
+User = get_user_model()
+
+
+def wait_for_variants(timeout=30):
+    """Block until scheduled variants are rendered or ``timeout`` ends."""
+    deadline = time.monotonic() + timeout
+    while thumbnails.pending and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+class RecipeQueryTestCase(TestCase):
+    """Recipe feed with users, tags, ingredients, favorites and carts."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                username=f'user{i}', email=f'user{i}@example.com',
+                password='password', first_name='Name', last_name='Last')
+            for i in range(3)
+        ]
+        cls.tags = [
+            Tag.objects.create(name=f'Tag {i}', color='#E26C2D',
+                               slug=f'tag{i}')
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredients.objects.create(name=f'ingredient {i}',
+                                       measurement_unit='г')
+            for i in range(10)
+        ]
+        for i in range(30):
+            recipe = Recipes.objects.create(
+                author=cls.users[i % 3], name=f'Recipe {i}', text='Text',
+                cooking_time=10, image='recipe/images/test.png')
+            recipe.tags.set(cls.tags[:i % 3 + 1])
+            IngredientPerRecipe.objects.bulk_create(
+                IngredientPerRecipe(recipe=recipe, ingredient=ingredient,
+                                    amount=j + 1)
+                for j, ingredient in enumerate(
+                    ingredients[i % 5:i % 5 + 4]))
+            recipe.is_favorited.add(cls.users[0])
+            if i % 2:
+                recipe.is_in_shopping_cart.add(cls.users[0])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def login(self, user=None):
+        self.client.force_authenticate(user or self.users[0])
+
+
+class RecipeListFlagsTests(RecipeQueryTestCase):
+    """Favorite and cart flags must not add queries per recipe."""
+
+    # COUNT, page, tags and ingredient rows.
+    PAGE_QUERIES = 4
+    # Plus the authors the user follows, read once per request.
+    USER_QUERIES = 1
+
+    def test_full_page_authenticated(self):
+        self.login()
+        with self.assertNumQueries(self.PAGE_QUERIES + self.USER_QUERIES):
+            response = self.client.get('/api/recipes/?limit=30')
+        self.assertEqual(len(response.data['results']), 30)
+        self.assertTrue(all(
+            recipe['is_favorited'] for recipe in response.data['results']))
+        self.assertEqual(
+            sum(recipe['is_in_shopping_cart']
+                for recipe in response.data['results']), 15)
+
+    def test_full_page_anonymous(self):
+        with self.assertNumQueries(self.PAGE_QUERIES):
+            response = self.client.get('/api/recipes/?limit=30')
+        self.assertEqual(len(response.data['results']), 30)
+        self.assertFalse(any(
+            recipe['is_favorited'] or recipe['is_in_shopping_cart']
+            for recipe in response.data['results']))
+
+    def flags(self):
+        response = self.client.get('/api/recipes/?limit=30')
+        return {
+            recipe['id']: (recipe['is_favorited'],
+                           recipe['is_in_shopping_cart'],
+                           recipe['author']['is_subscribed'])
+            for recipe in response.data['results']
+        }
+
+    def test_flags_of_each_viewer(self):
+        recipes = Recipes.objects.order_by('id')
+        favorite, carted = recipes[0], recipes[1]
+        self.users[1].favorite.add(favorite)
+        self.users[1].shopping_cart.add(carted)
+        Subscription.objects.create(user=self.users[1], author=carted.author)
+        owner = {
+            recipe.id: (True, index % 2 == 1, False)
+            for index, recipe in enumerate(recipes)
+        }
+        other = {
+            recipe.id: (recipe == favorite, recipe == carted,
+                        recipe.author_id == carted.author_id)
+            for recipe in recipes
+        }
+        anonymous = {recipe.id: (False, False, None) for recipe in recipes}
+        for user, expected in ((None, anonymous), (self.users[0], owner),
+                               (self.users[1], other)):
+            with self.subTest(user=user):
+                self.client.force_authenticate(user)
+                self.assertEqual(self.flags(), expected)
+
+    def test_anonymous_page_is_cached(self):
+        self.client.get('/api/recipes/?limit=30')
+        with self.assertNumQueries(0):
+            self.client.get('/api/recipes/?limit=30')
+
+    def test_cache_hits_are_published(self):
+        key = (metrics.CACHE_REQUESTS, ('recipes', 'hit'))
+        before = metrics.registry.counters.get(key, 0)
+        self.client.get('/api/recipes/?limit=30')
+        self.client.get('/api/recipes/?limit=30')
+        self.assertEqual(metrics.registry.counters[key], before + 1)
+        self.assertIn('foodgram_cache_requests_total'
+                      '{cache="recipes",result="hit"}', metrics.render())
+
+
+class RecipeQueryBudgetTests(RecipeQueryTestCase):
+    """The feed costs a fixed number of queries whatever the page size."""
+
+    PAGE_SIZES = (1, 6, 30)
+    # Authors the user follows, COUNT, page, tags and ingredient rows.
+    PAGE_QUERIES = 5
+    # The keyset paginator skips the COUNT.
+    CURSOR_QUERIES = 4
+
+    def filter_combinations(self):
+        author = self.users[1].id
+        for favorited, cart, by_author, tags in product(
+                (False, True), (False, True), (False, True),
+                ((), ('tag0',), ('tag0', 'tag1'))):
+            params = [('tags', tag) for tag in tags]
+            if favorited:
+                params.append(('is_favorited', 1))
+            if cart:
+                params.append(('is_in_shopping_cart', 1))
+            if by_author:
+                params.append(('author', author))
+            yield '&'.join(f'{name}={value}' for name, value in params)
+
+    def assert_budget(self, url, queries):
+        with self.subTest(url=url):
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.data['results'])
+
+    def test_page_number_budget(self):
+        self.login()
+        for query, size in product(self.filter_combinations(),
+                                   self.PAGE_SIZES):
+            self.assert_budget(f'/api/recipes/?limit={size}&{query}',
+                               self.PAGE_QUERIES)
+
+    def test_cursor_budget(self):
+        self.login()
+        for query, size in product(self.filter_combinations(),
+                                   self.PAGE_SIZES):
+            self.assert_budget(
+                f'/api/recipes/?pagination=cursor&limit={size}&{query}',
+                self.CURSOR_QUERIES)
+
+    def test_detail_budget(self):
+        self.login()
+        recipe = Recipes.objects.first()
+        # Authors the user follows, the recipe, tags and ingredient rows.
+        with self.assertNumQueries(4):
+            self.client.get(f'/api/recipes/{recipe.id}/')
+
+
+class CursorPaginationTests(RecipeQueryTestCase):
+    """Cursor pages follow (pub_date, id) even when pub_dates tie."""
+
+    def setUp(self):
+        super().setUp()
+        # Three runs of ten recipes sharing one pub_date each.
+        now = timezone.now()
+        for i, recipe_id in enumerate(Recipes.objects.order_by(
+                'id').values_list('id', flat=True)):
+            Recipes.objects.filter(id=recipe_id).update(
+                pub_date=now - timedelta(minutes=i // 10))
+        self.expected = list(Recipes.objects.order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+
+    def walk(self, url, link):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data[link]
+        return ids
+
+    def test_forward_pages_cover_every_recipe_once(self):
+        self.assertEqual(
+            self.walk('/api/recipes/?pagination=cursor&limit=4', 'next'),
+            self.expected)
+
+    def test_backward_pages_cover_every_recipe_once(self):
+        url = '/api/recipes/?pagination=cursor&limit=4'
+        while True:
+            response = self.client.get(url)
+            if not response.data['next']:
+                break
+            url = response.data['next']
+        ids = self.walk(response.data['previous'], 'previous')
+        self.assertEqual(sorted(ids), sorted(self.expected[:-2]))
+
+    def test_insert_between_pages_repeats_nothing(self):
+        response = self.client.get('/api/recipes/?pagination=cursor&limit=4')
+        first = [recipe['id'] for recipe in response.data['results']]
+        newest = Recipes.objects.get(id=first[0])
+        Recipes.objects.create(
+            author=newest.author, name='Tied', text='Text', cooking_time=1,
+            image=newest.image, pub_date=newest.pub_date)
+        rest = self.walk(response.data['next'], 'next')
+        self.assertEqual(first + rest, self.expected)
+
+    def test_malformed_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=cD1nYXJiYWdl')
+        self.assertEqual(response.status_code, 404)
+
+
+class CartTotalsTests(RecipeQueryTestCase):
+    """Cart totals follow every way recipes and carts can change."""
+
+    # Recipe with tags and ingredients, collected ingredient rows, cart
+    # users, totals upsert and cleanup, one DELETE per table and the
+    # author's recipe count: 14 whatever the number of ingredients.
+    DELETE_QUERIES = 14
+    # Recipe, ingredients, the diff in one statement per kind of change
+    # between a totals move out and back in, then the response: 15 for
+    # any number of changed amounts, as the recipe row is not saved
+    # when only ingredients are sent.
+    UPDATE_QUERIES = 15
+
+    def assert_totals_match(self):
+        self.assertEqual(
+            set(ShoppingCartIngredient.objects.values_list(
+                'user_id', 'ingredient_id', 'amount')),
+            set(ShoppingCartIngredient.objects.live_totals()))
+
+    def test_initial_totals(self):
+        self.assertTrue(ShoppingCartIngredient.objects.exists())
+        self.assert_totals_match()
+
+    def test_recipe_deleted(self):
+        Recipes.objects.filter(is_in_shopping_cart=self.users[0])[0].delete()
+        self.assert_totals_match()
+
+    def big_recipe(self):
+        """Recipe of 30 ingredients in two carts, logged in as author."""
+        recipe = Recipes.objects.create(
+            author=self.users[1], name='Big', text='Text', cooking_time=10,
+            image='recipe/images/test.png')
+        IngredientPerRecipe.objects.bulk_create(
+            IngredientPerRecipe(
+                recipe=recipe, amount=1,
+                ingredient=Ingredients.objects.create(
+                    name=f'extra {i}', measurement_unit='г'))
+            for i in range(30))
+        recipe.is_in_shopping_cart.add(self.users[0], self.users[2])
+        self.login(self.users[1])
+        return recipe
+
+    def test_recipe_delete_queries_do_not_grow_with_ingredients(self):
+        recipe = self.big_recipe()
+        with self.assertNumQueries(self.DELETE_QUERIES):
+            response = self.client.delete(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assert_totals_match()
+
+    def test_recipe_update_queries_do_not_grow_with_ingredients(self):
+        recipe = self.big_recipe()
+        rows = list(recipe.ingredientperrecipe_set.all())
+        with self.assertNumQueries(self.UPDATE_QUERIES):
+            response = self.client.patch(
+                f'/api/recipes/{recipe.id}/',
+                {'ingredients': [
+                    {'id': row.ingredient_id, 'amount': 2} for row in rows]},
+                format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_totals_match()
+
+    def test_author_deleted(self):
+        self.users[1].delete()
+        self.assert_totals_match()
+
+    def test_failed_delete_keeps_rows_tracked(self):
+        recipe = Recipes.objects.filter(is_in_shopping_cart=self.users[0])[0]
+        with mock.patch.object(Recipes, 'delete', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                delete_recipe(recipe)
+        self.assertEqual(batched_recipes.get(), frozenset())
+        row = recipe.ingredientperrecipe_set.first()
+        row.amount += 10
+        row.save()
+        self.assert_totals_match()
+
+    def test_ingredient_rows_changed(self):
+        recipe = Recipes.objects.filter(is_in_shopping_cart=self.users[0])[0]
+        rows = list(recipe.ingredientperrecipe_set.all())
+        rows[0].amount += 5
+        rows[0].save()
+        rows[1].ingredient = Ingredients.objects.exclude(
+            ingredientperrecipe__recipe=recipe).first()
+        rows[1].save()
+        rows[2].delete()
+        IngredientPerRecipe.objects.create(
+            recipe=recipe, ingredient=rows[2].ingredient, amount=7)
+        self.assert_totals_match()
+
+    def test_cart_edited_through_manager(self):
+        user = self.users[1]
+        user.shopping_cart.add(*Recipes.objects.all()[:4])
+        self.assert_totals_match()
+        user.shopping_cart.remove(*Recipes.objects.all()[2:6])
+        self.assert_totals_match()
+        Recipes.objects.first().is_in_shopping_cart.clear()
+        self.assert_totals_match()
+
+    def test_recipe_updated_through_api(self):
+        recipe = Recipes.objects.filter(is_in_shopping_cart=self.users[0])[0]
+        rows = list(recipe.ingredientperrecipe_set.all())
+        self.login(recipe.author)
+        response = self.client.patch(
+            f'/api/recipes/{recipe.id}/',
+            {'ingredients': [
+                {'id': rows[0].ingredient_id, 'amount': 50},
+                {'id': rows[1].ingredient_id, 'amount': rows[1].amount},
+                {'id': Ingredients.objects.exclude(
+                    ingredientperrecipe__recipe=recipe).first().id,
+                 'amount': 3},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_totals_match()
+
+
+class ShoppingListTests(TestCase):
+    """The download sums amounts of ingredients shared by recipes."""
+
+    def test_shared_ingredient_summed(self):
+        user = User.objects.create_user(
+            username='user', email='user@example.com', password='password')
+        salt, sugar = (
+            Ingredients.objects.create(name=name, measurement_unit='г')
+            for name in ('salt', 'sugar'))
+        for name, amounts in (('Soup', {salt: 5}),
+                              ('Cake', {salt: 1, sugar: 200})):
+            recipe = Recipes.objects.create(
+                author=user, name=name, text='Text', cooking_time=5)
+            IngredientPerRecipe.objects.bulk_create(
+                IngredientPerRecipe(recipe=recipe, ingredient=ingredient,
+                                    amount=amount)
+                for ingredient, amount in amounts.items())
+            recipe.is_in_shopping_cart.add(user)
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[1:], ['salt (г) - 6', 'sugar (г) - 200'])
+        self.assertEqual(
+            sorted(lines[0].split(' for ', 1)[1].split(',')),
+            ['Cake', 'Soup'])
+
+
+class BulkLinksTests(RecipeQueryTestCase):
+    """Bulk requests count only the links they actually change."""
+
+    def favorites_counts(self, recipes):
+        return [Recipes.objects.get(id=recipe.id).favorites_count
+                for recipe in recipes]
+
+    def test_counts_follow_changed_links(self):
+        self.login(self.users[1])
+        recipes = list(Recipes.objects.order_by('id')[:3])
+        self.client.post(f'/api/recipes/{recipes[0].id}/favorite/')
+        response = self.client.post(
+            '/api/recipes/favorite/',
+            {'recipes': [recipe.id for recipe in recipes[:2]]},
+            format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.favorites_counts(recipes), [2, 2, 1])
+        response = self.client.delete(
+            '/api/recipes/favorite/',
+            {'recipes': [recipe.id for recipe in recipes]}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.favorites_counts(recipes), [1, 1, 1])
+
+
+class ShortRecipeResponseTests(RecipeQueryTestCase):
+    """Toggles answer with the short form of the recipes."""
+
+    SHORT_FIELDS = {'id', 'name', 'image', 'cooking_time'}
+
+    def test_toggles(self):
+        self.login(self.users[1])
+        recipe = Recipes.objects.first()
+        for action in ('favorite', 'shopping_cart'):
+            with self.subTest(action=action):
+                response = self.client.post(
+                    f'/api/recipes/{recipe.id}/{action}/')
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response.data.keys(), self.SHORT_FIELDS)
+                self.assertEqual(response.data['id'], recipe.id)
+                self.assertEqual(response.data['name'], recipe.name)
+
+    def test_bulk_toggles(self):
+        self.login(self.users[1])
+        ids = list(Recipes.objects.values_list('id', flat=True)[:2])
+        for action in ('favorite', 'shopping_cart'):
+            with self.subTest(action=action):
+                response = self.client.post(
+                    f'/api/recipes/{action}/', {'recipes': ids},
+                    format='json')
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(
+                    sorted(recipe['id'] for recipe in response.data),
+                    sorted(ids))
+                for recipe in response.data:
+                    self.assertEqual(recipe.keys(), self.SHORT_FIELDS)
+
+    def test_subscribe(self):
+        self.login(self.users[1])
+        response = self.client.post(
+            f'/api/users/{self.users[2].id}/subscribe/?recipes_limit=2')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['recipes']), 2)
+        for recipe in response.data['recipes']:
+            self.assertEqual(recipe.keys(), self.SHORT_FIELDS)
+
+
+class FavoritesCountTests(RecipeQueryTestCase):
+    """favorites_count follows links changed outside the API."""
+
+    def assert_counts_match(self):
+        self.assertEqual(
+            dict(Recipes.objects.values_list('id', 'favorites_count')),
+            dict(Recipes.objects.annotate(
+                count=Count('is_favorited')).values_list('id', 'count')))
+
+    def test_initial_counts(self):
+        self.assertEqual(Recipes.objects.first().favorites_count, 1)
+        self.assert_counts_match()
+
+    def test_edited_through_manager(self):
+        recipe = Recipes.objects.first()
+        recipe.is_favorited.add(self.users[1], self.users[2])
+        self.assert_counts_match()
+        recipe.is_favorited.remove(self.users[0], self.users[1])
+        self.assert_counts_match()
+        recipe.is_favorited.set([self.users[0]])
+        self.assert_counts_match()
+        self.users[1].favorite.add(*Recipes.objects.all()[:5])
+        self.assert_counts_match()
+        self.users[0].favorite.clear()
+        self.assert_counts_match()
+
+    def test_user_deleted(self):
+        self.users[2].favorite.add(*Recipes.objects.all()[:5])
+        self.users[0].delete()
+        self.assert_counts_match()
+        self.users[2].delete()
+        self.assert_counts_match()
+
+    def test_patch_keeps_concurrent_favorite(self):
+        recipe = Recipes.objects.first()
+        stale = Recipes.objects.get(id=recipe.id)
+        recipe.is_favorited.add(self.users[1])
+        request = APIRequestFactory().patch('/')
+        request.user = recipe.author
+        serializer = RecipeUpdateSerializer(
+            stale, data={'name': 'Renamed'}, partial=True,
+            context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Renamed')
+        self.assert_counts_match()
+
+    def test_full_save_keeps_concurrent_favorite(self):
+        recipe = Recipes.objects.first()
+        stale = Recipes.objects.get(id=recipe.id)
+        recipe.is_favorited.add(self.users[1])
+        stale.name = 'Renamed'
+        stale.save()
+        self.assert_counts_match()
+
+
+class RecipeImageTests(RecipeQueryTestCase):
+    """Uploaded images are written only once the recipe is saved."""
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # Cleanups run last first: jobs finish in the temporary root.
+        self.addCleanup(wait_for_variants)
+        self.media = media.name
+        buffer = io.BytesIO()
+        Image.new('RGB', (4, 4), 'red').save(buffer, 'PNG')
+        self.image = ('data:image/png;base64,'
+                      + base64.b64encode(buffer.getvalue()).decode())
+        self.login()
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.media) for name in names]
+
+    def post_recipe(self, ingredients):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/recipes/', {
+                'name': 'Recipe', 'text': 'Text', 'cooking_time': 5,
+                'tags': [self.tags[0].id], 'image': self.image,
+                'ingredients': ingredients,
+            }, format='json')
+
+    def test_invalid_recipe_stores_nothing(self):
+        response = self.post_recipe([{'id': 0, 'amount': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_image_stored_on_commit(self):
+        ingredient = Ingredients.objects.first()
+        response = self.post_recipe([{'id': ingredient.id, 'amount': 1}])
+        self.assertEqual(response.status_code, 201)
+        recipe = Recipes.objects.get(id=response.data['id'])
+        self.assertTrue(os.path.exists(recipe.image.path))
+
+    def test_multipart_upload(self):
+        ingredient = Ingredients.objects.first()
+        image = SimpleUploadedFile(
+            'image.png', base64.b64decode(self.image.split(',')[1]),
+            'image/png')
+        request = APIRequestFactory().post('/api/recipes/', {
+            'name': 'Recipe', 'text': 'Text', 'cooking_time': 5,
+            'tags': [self.tags[0].id], 'image': image,
+            'ingredients': json.dumps([{'id': ingredient.id, 'amount': 1}]),
+        })
+        force_authenticate(request, self.users[0])
+        # Called directly, as the test client closes the uploaded files
+        # with the response, before deferred callbacks could run.
+        with self.captureOnCommitCallbacks(execute=True):
+            response = RecipeViewSet.as_view({'post': 'create'})(request)
+        self.assertEqual(response.status_code, 201)
+        recipe = Recipes.objects.get(id=response.data['id'])
+        self.assertTrue(os.path.exists(recipe.image.path))
+
+    @override_settings(UPLOAD_MAX_FILE_SIZE=128 * 1024)
+    def test_size_limit_aborts_mid_stream(self):
+        body = encode_multipart(BOUNDARY, {'image': SimpleUploadedFile(
+            'big.png', b'x' * 1024 * 1024, 'image/png')})
+        stream = io.BytesIO(body)
+        parser = MultiPartParser(
+            {'CONTENT_TYPE': MULTIPART_CONTENT,
+             'CONTENT_LENGTH': len(body)},
+            stream, [SizeLimitUploadHandler(), TemporaryFileUploadHandler()])
+        with self.assertRaises(MultiPartParserError):
+            parser.parse()
+        self.assertLess(stream.tell(), len(body) // 4)
+
+    @override_settings(UPLOAD_MAX_FILE_SIZE=128 * 1024)
+    def test_upload_over_limit_rejected(self):
+        response = self.client.post('/api/recipes/', {
+            'name': 'Recipe', 'text': 'Text', 'cooking_time': 5,
+            'image': SimpleUploadedFile(
+                'big.png', b'x' * 1024 * 1024, 'image/png'),
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_variant_sizes(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (3000, 1000), 'red').save(buffer, 'PNG')
+        name = default_storage.save('recipe/images/wide.png', buffer)
+        thumbnails.render_variants(name)
+        sizes = {}
+        for variant, target in thumbnails.variant_names(name).items():
+            with default_storage.open(target) as file:
+                sizes[variant] = Image.open(file).size
+        self.assertEqual(sizes, {'thumbnail': (480, 480),
+                                 'full': (1920, 640)})
+
+    def test_full_queue_drops_job(self):
+        slots = BoundedSemaphore(1)
+        slots.acquire()
+        with mock.patch.object(thumbnails, 'slots', slots), mock.patch.object(
+                thumbnails, 'render_variants') as render:
+            with self.assertLogs('recipe.thumbnails', 'WARNING'):
+                thumbnails.schedule_variants('recipe/images/busy.png')
+        render.assert_not_called()
+        self.assertEqual(thumbnails.pending, set())
+
+    def test_failed_render_logged(self):
+        thumbnails.slots.acquire()
+        with self.assertLogs('recipe.thumbnails', 'ERROR'):
+            # In a worker thread, which closes its own DB connection.
+            thumbnails.executor.submit(
+                thumbnails.run_in_slot, 'recipe/images/missing.png'
+            ).result()
+
+    def test_variants_listed_once_rendered(self):
+        recipe = Recipes.objects.first()
+        url = f'/api/recipes/{recipe.id}/'
+        original = self.client.get(url).data['image']
+        self.assertEqual(self.client.get(url).data['image_variants'],
+                         {'thumbnail': original, 'full': original})
+        thumbnails.mark_ready(recipe.image.name)
+        cache.clear()
+        variants = self.client.get(url).data['image_variants']
+        self.assertEqual(variants['thumbnail'], 'http://testserver/media/'
+                         'recipe/images/thumbnail/test.webp')
+        # Listing them costs no storage calls.
+        with mock.patch.object(default_storage, 'exists') as exists:
+            self.client.get('/api/recipes/?limit=30')
+        exists.assert_not_called()
+
+
+class CacheInvalidationTests(TestCase):
+    """Cached responses are invalidated only once the write commits."""
+
+    def test_generation_bumped_on_commit(self):
+        before = get_generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Tag', color='#E26C2D', slug='tag')
+            self.assertEqual(get_generation(), before)
+        self.assertGreater(get_generation(), before)
+
+    def test_generation_survives_response_cache_clear(self):
+        before = get_generation()
+        cache.clear()
+        self.assertEqual(get_generation(), before)
+
+    def test_lost_generation_never_goes_back(self):
+        before = get_generation()
+        versions.delete(GENERATION_KEY)
+        self.assertGreater(get_generation(), before)
+
+    def test_bulk_ingredient_load_invalidates_catalog(self):
+        before = get_version(catalog_key('ingredients'))
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.csv', encoding='utf-8') as file:
+            file.write('salt,г\n')
+            file.flush()
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('load_ingredients', file.name,
+                             stdout=io.StringIO())
+        self.assertGreater(get_version(catalog_key('ingredients')), before)
+        response = self.client.get('/api/ingredients/?name=sal')
+        self.assertEqual([item['name'] for item in response.json()],
+                         ['salt'])
+
+    def test_json_ingredients_load_incrementally(self):
+        items = [{'name': f'spice {i}', 'measurement_unit': 'г'}
+                 for i in range(50)]
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.json', encoding='utf-8') as file:
+            json.dump(items, file, ensure_ascii=False, indent=1)
+            file.flush()
+            with mock.patch.object(
+                    load_ingredients.read_json, '__defaults__', (16,)):
+                call_command('load_ingredients', file.name,
+                             stdout=io.StringIO())
+        self.assertEqual(
+            Ingredients.objects.filter(name__startswith='spice').count(), 50)
+
+
+class GenerateDatasetTests(TestCase):
+    """generate_dataset fills counters and links consistently."""
+
+    def generate(self, prefix, **options):
+        Ingredients.objects.bulk_create(
+            Ingredients(name=f'ingredient {i}', measurement_unit='г')
+            for i in range(40))
+        call_command(
+            'generate_dataset', prefix=prefix, users=5, recipes=12, tags=3,
+            subscriptions=100, favorites=30, cart=6, batch_size=4,
+            stdout=io.StringIO(), **options)
+        users = User.objects.filter(username__startswith=prefix)
+        return users, Recipes.objects.filter(author__in=users)
+
+    def test_counts_and_links(self):
+        users, recipes = self.generate('gen')
+        self.assertEqual(users.count(), 5)
+        self.assertEqual(recipes.count(), 12)
+        subscriptions = Subscription.objects.filter(user__in=users)
+        # More subscriptions than pairs asked for: every pair but self.
+        self.assertEqual(subscriptions.count(), 5 * 4)
+        self.assertFalse(subscriptions.filter(user=F('author')).exists())
+        self.assertEqual(
+            Recipes.is_favorited.through.objects.filter(
+                user__in=users).count(), 30)
+        self.assertEqual(
+            dict(recipes.values_list('id', 'favorites_count')),
+            dict(recipes.annotate(count=Count('is_favorited')).values_list(
+                'id', 'count')))
+        for user in users:
+            self.assertEqual(user.stats.recipes_count,
+                             recipes.filter(author=user).count())
+
+    def test_existing_prefix_refused(self):
+        self.generate('gen')
+        with self.assertRaises(CommandError):
+            call_command('generate_dataset', prefix='gen',
+                         stdout=io.StringIO())
+
+
+class BenchmarkCommandTests(TestCase):
+    """benchmark refuses options it cannot summarize."""
+
+    def test_no_timed_requests_refused(self):
+        with self.assertRaisesMessage(CommandError, '--requests'):
+            call_command('benchmark', requests=0, stdout=io.StringIO())
+
+
+class IngredientSearchTests(TestCase):
+    """Autocomplete ranks prefix matches first and ignores ё."""
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for name in ('фасоль', 'соль', 'солод', 'мёд', 'сахар'):
+                Ingredients.objects.create(name=name, measurement_unit='г')
+
+    def search(self, query):
+        response = self.client.get('/api/ingredients/', {'name': query})
+        return [item['name'] for item in response.json()]
+
+    def test_prefix_matches_first(self):
+        self.assertEqual(self.search('сол'), ['солод', 'соль', 'фасоль'])
+
+    def test_yo_matches_ye(self):
+        for query in ('мед', 'мёд', 'МЁД'):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query), ['мёд'])
+
+
+class CatalogETagTests(TestCase):
+    """Catalogs answer 304 to any If-None-Match that matches their ETag."""
+
+    def setUp(self):
+        cache.clear()
+        Tag.objects.create(name='Tag', color='#E26C2D', slug='tag')
+        self.etag = self.client.get('/api/tags/')['ETag']
+
+    def test_if_none_match(self):
+        for header, status in (
+                (self.etag, 304),
+                (f'"other", {self.etag}', 304),
+                (f'W/{self.etag}', 304),
+                ('*', 304),
+                ('"other"', 200)):
+            with self.subTest(header=header):
+                response = self.client.get(
+                    '/api/tags/', HTTP_IF_NONE_MATCH=header)
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(response['ETag'], self.etag)
+
+
+class AsyncViewTests(TransactionTestCase):
+    """Async views and the ASGI handler serve what the sync ones do."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password')
+        tag = Tag.objects.create(name='Tag', color='#E26C2D', slug='tag')
+        ingredient = Ingredients.objects.create(
+            name='salt', measurement_unit='г')
+        recipe = Recipes.objects.create(
+            author=self.user, name='Recipe', text='Text', cooking_time=5)
+        recipe.tags.set([tag])
+        IngredientPerRecipe.objects.create(
+            recipe=recipe, ingredient=ingredient, amount=3)
+        recipe.is_in_shopping_cart.add(self.user)
+
+    def test_async_views_return_sync_payload(self):
+        for path in ('/api/recipes/', '/api/tags/', '/api/ingredients/',
+                     '/api/ingredients/?name=sa'):
+            with self.subTest(path=path):
+                match = resolve(path.partition('?')[0])
+                responses = []
+                for view in (match.func, async_to_sync(
+                        async_read_view(match.func))):
+                    cache.clear()
+                    response = view(RequestFactory().get(path),
+                                    *match.args, **match.kwargs)
+                    # Catalogs are served as cached bytes, not rendered.
+                    if hasattr(response, 'render'):
+                        response.render()
+                    responses.append(response)
+                self.assertEqual(
+                    [response.status_code for response in responses],
+                    [200, 200])
+                self.assertEqual(json.loads(responses[0].content),
+                                 json.loads(responses[1].content))
+
+    def test_streamed_body_pulled_in_blocks(self):
+        token = Token.objects.create(user=self.user)
+        expected = self.client.get(
+            '/api/recipes/download_shopping_cart/',
+            HTTP_AUTHORIZATION=f'Token {token.key}')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'},
+            'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': '/api/recipes/download_shopping_cart/',
+            'query_string': b'', 'server': ('testserver', 80),
+            'client': ('127.0.0.1', 0),
+            'headers': [(b'host', b'testserver'), (
+                b'authorization', f'Token {token.key}'.encode())],
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        with mock.patch.object(handlers, 'next_block',
+                               wraps=handlers.next_block) as next_block:
+            async_to_sync(StreamingASGIHandler())(scope, receive, send)
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual(
+            b''.join(message.get('body', b'') for message in messages[1:]),
+            b''.join(expected.streaming_content))
+        # One block holds the whole list, the second call ends it.
+        self.assertEqual(next_block.call_count, 2)
+
+
+class MetricsTests(TestCase):
+    """Staff read per-route metrics labelled by route, method and status."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password')
+        self.staff = User.objects.create_user(
+            username='staff', email='staff@example.com',
+            password='password', is_staff=True)
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+    def test_route_labels(self):
+        self.client.get('/api/tags/')
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        body = response.content.decode()
+        self.assertIn('# TYPE foodgram_http_request_duration_seconds '
+                      'histogram', body)
+        self.assertIn('foodgram_http_db_queries_count{route="tags-list",'
+                      'method="GET",status="200"}', body)
+        self.assertIn('foodgram_http_request_duration_seconds_bucket{'
+                      'route="tags-list",method="GET",status="200",'
+                      'le="+Inf"}', body)
+
+
+class ProfilingTests(TestCase):
+    """Only staff and signed links get requests profiled."""
+
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+        self.addCleanup(local_tokens.clear)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(PROFILE_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.directory = directory.name
+        self.tokens = {}
+        for name, is_staff in (('user', False), ('staff', True)):
+            user = User.objects.create_user(
+                username=name, email=f'{name}@example.com',
+                password='password', is_staff=is_staff)
+            self.tokens[name] = Token.objects.create(user=user).key
+
+    def get(self, path, user=None, **headers):
+        if user:
+            headers['HTTP_AUTHORIZATION'] = f'Token {self.tokens[user]}'
+        return self.client.get(path, **headers)
+
+    def test_header_ignored_for_non_staff(self):
+        for user in (None, 'user'):
+            with self.subTest(user=user):
+                response = self.get('/api/tags/', user, HTTP_X_PROFILE='1')
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_staff_request_profiled(self):
+        response = self.get('/api/tags/', 'staff', HTTP_X_PROFILE='1')
+        name = response['X-Profile-Id']
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         [f'{name}.json', f'{name}.prof'])
+        with open(os.path.join(self.directory, f'{name}.json')) as file:
+            trace = json.load(file)
+        self.assertEqual(trace['status'], 200)
+        self.assertEqual(trace['query_count'], len(trace['statements']))
+
+    def test_signed_link(self):
+        signature = sign_profile_path('/api/tags/')
+        response = self.get(f'/api/tags/?profile={signature}')
+        self.assertIn('X-Profile-Id', response)
+        response = self.get(f'/api/ingredients/?profile={signature}')
+        self.assertNotIn('X-Profile-Id', response)
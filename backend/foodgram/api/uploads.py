@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    """Abort a multipart upload as soon as a file grows past the limit."""
+
+    def new_file(self, *args, **kwargs):
+        """Reset the counter for every uploaded file."""
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        """Count the streamed bytes and pass the chunk on."""
+        self.received += len(raw_data)
+        if self.received > settings.UPLOAD_MAX_FILE_SIZE:
+            raise MultiPartParserError(
+                f'File {self.file_name} exceeds '
+                f'{settings.UPLOAD_MAX_FILE_SIZE} bytes.')
+        return raw_data
+
+    def file_complete(self, file_size):
+        """Leave building the file to the next handler."""
@@ -1,9 +1,11 @@
+from django.conf import settings
 from django.urls import include, path, re_path
 from rest_framework import routers
 from users.views import (CurrentUserView, CustomAuthToken, DeleteTokenView,
                          FollowingListView, UpdatePasswordView, UserViewSet)
 
-from .views import IngredientViewSet, RecipeViewSet, ShoppingList, TagViewSet
+from .views import (IngredientViewSet, MetricsView, RecipeViewSet,
+                    ShoppingList, TagViewSet)
 
 router = routers.DefaultRouter()
 router.register(r'recipes', RecipeViewSet, basename='recipe')
@@ -25,5 +27,12 @@ urlpatterns = [
          name='current-user'),
     path('recipes/download_shopping_cart/',
          ShoppingList.as_view(), name='shopping_list_download'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     re_path(r'', include(router.urls)),
 ]
+
+if settings.ASYNC_VIEWS:
+    from .async_views import make_async
+
+    make_async(urlpatterns)
+    make_async(router.urls)
@@ -1,58 +1,108 @@
-from django.http import HttpResponse
-from recipe.models import IngredientPerRecipe, Ingredients, Recipes, Tag
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Exists, F, OuterRef, Prefetch, Value
+from django.http import HttpResponse, StreamingHttpResponse
+from recipe.models import (IngredientPerRecipe, Ingredients, Recipes,
+                           ShoppingCartIngredient, Tag)
+from recipe.signals import delete_recipe
 from rest_framework import filters, permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from . import metrics
+from .cache import CatalogCache, cached_response
 from .pagination import RecipePagination
 from .permissions import IsAuthorOrAdmin
+from .search import IngredientIndex
 from .serializers import (IngredientPerRecipeSerializer, IngredientSerializer,
-                          RecipeSerializer, RecipeUpdateSerializer,
+                          RecipeBulkSerializer, RecipeSerializer,
+                          RecipeShortSerializer, RecipeUpdateSerializer,
                           TagSerializer)
 
+User = get_user_model()
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     """ViewSet for Recipe model."""
 
-    queryset = Recipes.objects.all()
+    queryset = Recipes.objects.select_related('author').prefetch_related(
+        Prefetch('tags', queryset=Tag.objects.all()),
+        Prefetch(
+            'ingredientperrecipe_set',
+            queryset=IngredientPerRecipe.objects.select_related('ingredient'),
+        ),
+    )
     serializer_class = RecipeSerializer
+    update_serializer_class = RecipeUpdateSerializer
     pagination_class = RecipePagination
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     ingredient = IngredientPerRecipeSerializer
+    link_actions = (
+        'favorite', 'shopping_cart', 'favorite_bulk', 'shopping_cart_bulk')
 
     def get_queryset(self):
         """Set additional query line parameters."""
-        queryset = super().get_queryset()
+        if self.action in self.link_actions:
+            return Recipes.objects.only('id', 'name', 'image', 'cooking_time')
+        queryset = self.annotate_user_flags(super().get_queryset())
         is_favorited = self.request.query_params.get('is_favorited')
         is_in_shopping_cart = self.request.query_params.get(
             'is_in_shopping_cart')
         author = self.request.query_params.get('author')
-        tags = self.request.query_params.get('tags')
 
         if is_favorited == '1':
-            user = self.request.user
-            queryset = queryset.filter(is_favorited=user)
+            queryset = queryset.filter(favorited=True)
 
         if is_in_shopping_cart == '1':
-            user = self.request.user
-            queryset = queryset.filter(is_in_shopping_cart=user)
+            queryset = queryset.filter(in_shopping_cart=True)
 
         if author:
             queryset = queryset.filter(author=author)
 
         tags = self.request.query_params.getlist('tags')
         if tags:
-            queryset = queryset.filter(tags__slug__in=tags).distinct()
+            queryset = self.filter_tags(queryset, tags)
 
         return queryset
 
-        return queryset
+    @staticmethod
+    def filter_tags(queryset, slugs):
+        """Recipes having any of the tags, without a join and distinct()."""
+        return queryset.filter(Exists(
+            Recipes.tags.through.objects.filter(
+                recipes=OuterRef('pk'), tag__slug__in=slugs)))
+
+    def annotate_user_flags(self, queryset):
+        """Annotate favorite and shopping cart flags for the current user."""
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.annotate(
+                favorited=Value(False, output_field=BooleanField()),
+                in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return queryset.annotate(
+            favorited=Exists(Recipes.is_favorited.through.objects.filter(
+                recipes=OuterRef('pk'), user=user)),
+            in_shopping_cart=Exists(
+                Recipes.is_in_shopping_cart.through.objects.filter(
+                    recipes=OuterRef('pk'), user=user)),
+        )
+
+    def list(self, request, *args, **kwargs):
+        """List recipes, serving anonymous visitors from the cache."""
+        return cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Show a recipe, serving anonymous visitors from the cache."""
+        return cached_response(super().retrieve, request, *args, **kwargs)
 
     def get_permissions(self):
         """Set permissions for Recipe-related actions."""
         if self.action == 'destroy' or self.action == 'partial_update':
             permission_classes = [IsAuthorOrAdmin]
+        elif self.action in self.link_actions:
+            permission_classes = [permissions.IsAuthenticated]
         elif self.request.method == 'POST':
             permission_classes = [permissions.IsAuthenticated]
         else:
@@ -62,8 +112,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         """Specify a specific Serializer for POST requests."""
         if self.request.method == 'GET':
-            return RecipeSerializer
-        return RecipeUpdateSerializer
+            return self.serializer_class
+        return self.update_serializer_class
 
     def perform_create(self, serializer):
         """Create a new recipe based on serializer response."""
@@ -73,68 +123,168 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Update a recipe based on serializer response."""
         serializer.save()
 
+    def perform_destroy(self, instance):
+        """Delete a recipe, adjusting cart totals once."""
+        delete_recipe(instance)
+
+    @staticmethod
+    def lock_links(user):
+        """Serialize link changes of the user until the transaction ends.
+
+        Counters are adjusted by the links a request saw change, so two
+        requests must not both see the same link as missing or present.
+        """
+        User.objects.select_for_update().filter(pk=user.pk).exists()
+
+    @classmethod
+    def add_link(cls, through, recipe, user):
+        """Insert a user-recipe link, return False if it already exists."""
+        cls.lock_links(user)
+        try:
+            with transaction.atomic():
+                through.objects.create(recipes=recipe, user=user)
+        except IntegrityError:
+            return False
+        return True
+
+    @classmethod
+    def remove_link(cls, through, recipe, user):
+        """Delete a user-recipe link, return False if there was none."""
+        cls.lock_links(user)
+        deleted, _ = through.objects.filter(
+            recipes=recipe, user=user).delete()
+        return bool(deleted)
+
     @action(detail=True, methods=['POST', 'DELETE'], url_path='favorite')
     def favorite(self, request, pk=None):
         """Handle favorite-related actions."""
         recipe = self.get_object()
         user = request.user
+        through = Recipes.is_favorited.through
         if request.method == 'POST':
-
-            if user in recipe.is_favorited.all():
+            with transaction.atomic():
+                added = self.add_link(through, recipe, user)
+                if added:
+                    self.count_favorites([recipe], user, 1)
+            if not added:
                 return Response(
                     {'errors': 'The recipe is already in favorites'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            recipe.is_favorited.add(user)
-            serializer = RecipeSerializer(
+            serializer = RecipeShortSerializer(
                 recipe, context={'request': request})
-            data = {
-                'id': serializer.data['id'],
-                'name': serializer.data['name'],
-                'image': serializer.data['image'],
-                'cooking_time': serializer.data['cooking_time']
-            }
-            return Response(data=data, status=status.HTTP_201_CREATED)
-        if request.method == 'DELETE':
-
-            if user not in recipe.is_favorited.all():
-                return Response(
-                    {'errors': 'No such recipe in the favorites'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            recipe.is_favorited.remove(user)
-            return Response(status=status.HTTP_204_NO_CONTENT)
+            return Response(
+                data=serializer.data, status=status.HTTP_201_CREATED)
+
+        with transaction.atomic():
+            removed = self.remove_link(through, recipe, user)
+            if removed:
+                self.count_favorites([recipe], user, -1)
+        if not removed:
+            return Response(
+                {'errors': 'No such recipe in the favorites'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['POST', 'DELETE'], url_path='shopping_cart')
     def shopping_cart(self, request, pk=None):
         """Handle actions with shopping cart."""
         recipe = self.get_object()
         user = request.user
+        through = Recipes.is_in_shopping_cart.through
         if request.method == 'POST':
-            if user in recipe.is_in_shopping_cart.all():
+            with transaction.atomic():
+                added = self.add_link(through, recipe, user)
+                if added:
+                    ShoppingCartIngredient.objects.apply_recipes(
+                        [recipe], [user.id])
+            if not added:
                 return Response(
                     {'errors': 'The recipe is already in the shopping cart'},
                     status=status.HTTP_400_BAD_REQUEST)
-            recipe.is_in_shopping_cart.add(user)
-            serializer = RecipeSerializer(
+            serializer = RecipeShortSerializer(
                 recipe, context={'request': request})
-            data = {
-                'id': serializer.data['id'],
-                'name': serializer.data['name'],
-                'image': serializer.data['image'],
-                'cooking_time': serializer.data['cooking_time']
-            }
-            return Response(data=data, status=status.HTTP_201_CREATED)
-
-        if request.method == 'DELETE':
-            if user not in recipe.is_in_shopping_cart.all():
-                return Response(
-                    {'errors': 'Cannot remove, no such recipe in the cart'},
-                    status=status.HTTP_400_BAD_REQUEST)
-        recipe.is_in_shopping_cart.remove(user)
+            return Response(
+                data=serializer.data, status=status.HTTP_201_CREATED)
+
+        with transaction.atomic():
+            removed = self.remove_link(through, recipe, user)
+            if removed:
+                ShoppingCartIngredient.objects.apply_recipes(
+                    [recipe], [user.id], sign=-1)
+        if not removed:
+            return Response(
+                {'errors': 'Cannot remove, no such recipe in the cart'},
+                status=status.HTTP_400_BAD_REQUEST)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    def count_favorites(recipes, user, sign):
+        """Adjust favorites counters of the recipes."""
+        queryset = Recipes.objects.filter(
+            pk__in=[recipe.pk for recipe in recipes])
+        if sign < 0:
+            queryset = queryset.filter(favorites_count__gt=0)
+        queryset.update(favorites_count=F('favorites_count') + sign)
+
+    @staticmethod
+    def apply_to_cart(recipes, user, sign):
+        """Adjust the shopping cart totals of the user."""
+        ShoppingCartIngredient.objects.apply_recipes(
+            recipes, [user.id], sign=sign)
+
+    def bulk_links(self, request, through, on_change=None):
+        """Add or remove links between the user and many recipes."""
+        serializer = RecipeBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipes = serializer.validated_data['recipes']
+        user = request.user
+        with transaction.atomic():
+            self.lock_links(user)
+            linked = set(through.objects.filter(
+                user=user, recipes__in=recipes
+            ).values_list('recipes_id', flat=True))
+            if request.method == 'POST':
+                changed = [
+                    recipe for recipe in recipes if recipe.id not in linked]
+                through.objects.bulk_create(
+                    [through(recipes=recipe, user=user)
+                     for recipe in changed],
+                    ignore_conflicts=True,
+                )
+                sign = 1
+            else:
+                changed = [
+                    recipe for recipe in recipes if recipe.id in linked]
+                through.objects.filter(
+                    user=user, recipes__in=changed).delete()
+                sign = -1
+            if changed and on_change is not None:
+                on_change(changed, user, sign)
+        if request.method == 'POST':
+            serializer = RecipeShortSerializer(
+                changed, many=True, context={'request': request})
+            return Response(
+                data=serializer.data, status=status.HTTP_201_CREATED)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['POST', 'DELETE'], url_path='favorite',
+            url_name='favorite-bulk')
+    def favorite_bulk(self, request):
+        """Add or remove many recipes to or from favorites."""
+        return self.bulk_links(
+            request, Recipes.is_favorited.through,
+            on_change=self.count_favorites)
+
+    @action(detail=False, methods=['POST', 'DELETE'],
+            url_path='shopping_cart', url_name='shopping-cart-bulk')
+    def shopping_cart_bulk(self, request):
+        """Add or remove many recipes to or from the shopping cart."""
+        return self.bulk_links(
+            request, Recipes.is_in_shopping_cart.through,
+            on_change=self.apply_to_cart)
+
 
 class IngredientViewSet(viewsets.ModelViewSet):
     """Handle Ingredient-related actions."""
@@ -144,6 +294,18 @@ class IngredientViewSet(viewsets.ModelViewSet):
     serializer_class = IngredientSerializer
     filter_backends = (filters.SearchFilter,)
     search_fields = ('name', )
+    catalog = CatalogCache(
+        'ingredients', Ingredients.objects.all(), IngredientSerializer)
+    index = IngredientIndex(catalog)
+
+    def list(self, request, *args, **kwargs):
+        """Serve the catalog from the cache, autocomplete from the index."""
+        name = request.query_params.get('name')
+        if name:
+            return Response(self.index.search(name))
+        if request.query_params:
+            return super().list(request, *args, **kwargs)
+        return self.catalog.response(request)
 
 
 class TagViewSet(viewsets.ModelViewSet):
@@ -153,38 +315,55 @@ class TagViewSet(viewsets.ModelViewSet):
     serializer_class = TagSerializer
     permission_classes = [permissions.AllowAny]
     pagination_class = None
+    catalog = CatalogCache('tags', Tag.objects.all(), TagSerializer)
+
+    def list(self, request, *args, **kwargs):
+        """Serve the tag catalog from the cache."""
+        return self.catalog.response(request)
 
 
 class ShoppingList(APIView):
     """Handle Shopping list printing."""
 
+    permission_classes = [permissions.IsAuthenticated]
+
     def get(self, request, *args, **kwargs):
         """Get all relevant recipes and compile a list."""
         user = request.user
-        recipes = Recipes.objects.filter(is_in_shopping_cart=user)
-        ingredient_list = {}
-        recipe_list = []
-
-        for recipe in recipes:
-            ingredients = IngredientPerRecipe.objects.filter(
-                recipe=recipe)
-            recipe_list.append(recipe.name)
-            for ingredient in ingredients:
-                ingredient_name = ingredient.ingredient
-                ingredient_amount = ingredient.amount
-                if ingredient_name in ingredient_list:
-                    ingredient_list[ingredient_name] += ingredient_amount
-                else:
-                    ingredient_list[ingredient_name] = ingredient_amount
-        final_list = 'Shopping list for ' + ',' .join(recipe_list) + '\n'
-        for ingredient, amount in ingredient_list.items():
-            ingredient_unit = Ingredients.objects.get(
-                name=ingredient).measurement_unit
-            final_list += (f'{ingredient} ({ingredient_unit}) - {amount}\n')
-        content = final_list
-        response = HttpResponse(content, content_type='text/plain')
+        recipes = Recipes.objects.filter(
+            is_in_shopping_cart=user).values_list('name', flat=True)
+        ingredients = ShoppingCartIngredient.objects.filter(
+            user=user
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        ).order_by('ingredient__name', 'ingredient__measurement_unit')
+        response = StreamingHttpResponse(
+            self.generate_lines(recipes, ingredients),
+            content_type='text/plain')
         response['Content-Disposition'] = (
             'attachment; filename="shopping_list.txt"'
         )
 
         return response
+
+    @staticmethod
+    def generate_lines(recipes, ingredients):
+        """Yield the shopping list line by line."""
+        yield 'Shopping list for '
+        separator = ''
+        for name in recipes.iterator():
+            yield separator + name
+            separator = ','
+        yield '\n'
+        for name, measurement_unit, amount in ingredients.iterator():
+            yield f'{name} ({measurement_unit}) - {amount}\n'
+
+
+class MetricsView(APIView):
+    """Expose request metrics of all workers in Prometheus format."""
+
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(metrics.render(),
+                            content_type=metrics.CONTENT_TYPE)
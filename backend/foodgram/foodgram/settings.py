@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -30,6 +31,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -37,6 +39,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -87,6 +90,11 @@ AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator'},
 ]
 
+AUTHENTICATION_BACKENDS = [
+    'users.backends.EmailBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 
 LANGUAGE_CODE = 'en-us'
 
@@ -102,12 +110,100 @@ USE_TZ = True
 RESULTS_PER_PAGE = 5
 
 
+# Every worker must see the same caches. The file backend is shared by
+# the workers of one host; point the backends at memcached or redis when
+# running several hosts. "default" holds cached responses and tokens and
+# may evict them. "versions" holds the few invalidation counters (recipe
+# generation, catalog versions), which must never be evicted: entries
+# never expire and MAX_ENTRIES is far above their number, so the file
+# backend never culls them.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            default=os.path.join(tempfile.gettempdir(), 'foodgram-cache')),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'versions': {
+        'BACKEND': os.getenv(
+            'VERSION_CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv(
+            'VERSION_CACHE_LOCATION',
+            default=os.path.join(tempfile.gettempdir(),
+                                 'foodgram-versions')),
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', default=300))
+
+CATALOG_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+
+INGREDIENT_SEARCH_LIMIT = 50
+
+# Cropped variants have exactly the given size, the others are scaled
+# down to fit inside it.
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': {'size': (480, 480), 'crop': True},
+    'full': {'size': (1920, 1920), 'crop': False},
+}
+
+IMAGE_WEBP_QUALITY = 80
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+
+IMAGE_QUEUE_SIZE = int(os.getenv('IMAGE_QUEUE_SIZE', default=32))
+
+UPLOAD_MAX_FILE_SIZE = int(
+    os.getenv('UPLOAD_MAX_FILE_SIZE', default=10 * 1024 * 1024))
+
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
+
+# Files up to FILE_UPLOAD_MAX_MEMORY_SIZE stay in memory, larger ones
+# are streamed to temporary files, all of them within the size limit.
+FILE_UPLOAD_HANDLERS = [
+    'api.uploads.SizeLimitUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Ignored when the cache is per process (locmem, dummy).
+AUTH_TOKEN_CACHE = 'default'
+
+AUTH_TOKEN_CACHE_TTL = 300
+
+AUTH_TOKEN_LOCAL_TTL = 5
+
+AUTH_TOKEN_LOCAL_SIZE = 10000
+
+# Shared by all workers of a deployment, clear it when they restart.
+METRICS_DIR = os.getenv('METRICS_DIR')
+
+METRICS_FLUSH_INTERVAL = 5
+
+# Profiling of single requests is disabled unless a directory is set.
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+
+PROFILE_SIGNATURE_MAX_AGE = 3600
+
+# Set by foodgram/asgi.py: serve hot read endpoints from async views.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS') == 'True'
+
+# Threads, and so database connections, per process for async views.
+ASYNC_VIEW_WORKERS = int(os.getenv('ASYNC_VIEW_WORKERS', default=8))
+
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': RESULTS_PER_PAGE,
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
 
 }
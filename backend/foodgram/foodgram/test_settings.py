@@ -0,0 +1,15 @@
+"""Settings for the tests.
+
+Tests clear the caches, so they get per-process ones instead of the
+file caches a deployment on the same host shares. Run them with
+``python manage.py test --settings=foodgram.test_settings``.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import CACHES
+
+CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': alias}
+    for alias in CACHES
+}
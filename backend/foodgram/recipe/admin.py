@@ -1,9 +1,14 @@
+from functools import partial
+
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
+from django.db import transaction
 from users.models import Subscription
 
 from .models import IngredientPerRecipe, Ingredients, Recipes, Tag
+from .signals import delete_recipe
+from .thumbnails import schedule_variants
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -30,13 +35,23 @@ class RecipesIngredientInline(admin.TabularInline):
 
 
 class RecipesAdmin(admin.ModelAdmin):
-    list_display = ['name', 'author', 'get_favorited_number']
+    list_display = ['name', 'author', 'favorites_count']
     list_filter = ['author', 'name', 'tags']
+    list_select_related = ['author']
+    readonly_fields = ['favorites_count', 'image_variants_ready']
     inlines = [RecipesIngredientInline]
 
-    def get_favorited_number(self, obj):
-        return obj.is_favorited.count()
-    get_favorited_number.short_description = 'Favorited count'
+    def delete_model(self, request, obj):
+        delete_recipe(obj)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            Recipes.objects.filter(pk=obj.pk).update(
+                image_variants_ready=False)
+            if obj.image:
+                transaction.on_commit(
+                    partial(schedule_variants, obj.image.name))
 
 
 admin.site.register(Ingredients, IngredientsAdmin)
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipe.models import ShoppingCartIngredient
+
+
+class Command(BaseCommand):
+    help = 'Compare shopping cart totals with the live join and rebuild them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report the drift, do not rebuild the table.')
+
+    def handle(self, *args, **options):
+        live = {
+            (user, ingredient): total
+            for user, ingredient, total
+            in ShoppingCartIngredient.objects.live_totals().iterator()
+        }
+        stored = {
+            (user, ingredient): amount
+            for user, ingredient, amount
+            in ShoppingCartIngredient.objects.values_list(
+                'user_id', 'ingredient_id', 'amount').iterator()
+        }
+        drift = [
+            key for key in live.keys() | stored.keys()
+            if live.get(key) != stored.get(key)
+        ]
+        for user, ingredient in sorted(drift):
+            self.stdout.write(
+                f'user {user}, ingredient {ingredient}: '
+                f'stored {stored.get((user, ingredient))}, '
+                f'live {live.get((user, ingredient))}')
+        self.stdout.write(f'{len(drift)} drifted rows found.')
+        if options['dry_run']:
+            return
+        with transaction.atomic():
+            ShoppingCartIngredient.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS('Shopping cart totals rebuilt.'))
@@ -0,0 +1,204 @@
+import random
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, islice, product
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipe.models import (IngredientPerRecipe, Ingredients, Recipes,
+                           ShoppingCartIngredient, Tag)
+from users.models import Subscription, UserStats
+
+User = get_user_model()
+
+START_DATE = datetime(2023, 1, 1, tzinfo=timezone.utc)
+TAG_COLORS = ['#E26C2D', '#49B64E', '#8775D2', '#F5C242', '#2D9CDB']
+
+
+def insert_rows(model, fields, rows, batch_size):
+    """Insert plain value tuples with executemany, skipping the ORM.
+
+    Building model instances dominates bulk_create() at millions of
+    rows, so link tables are filled directly.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(
+        connection.ops.quote_name(model._meta.get_field(field).column)
+        for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    sql = f'INSERT INTO {table} ({columns}) VALUES ({placeholders})'
+    rows = iter(rows)
+    with connection.cursor() as cursor:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            cursor.executemany(sql, batch)
+
+
+def zipf_weights(size, alpha):
+    """Cumulative weights where the item of rank r has weight 1/r**alpha."""
+    return list(accumulate(1 / rank ** alpha for rank in range(1, size + 1)))
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic synthetic dataset for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=8)
+        parser.add_argument('--subscriptions', type=int, default=5000)
+        parser.add_argument('--favorites', type=int, default=50000)
+        parser.add_argument('--cart', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--alpha', type=float, default=1.1,
+            help='Exponent of the power-law popularity skew.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--prefix', default='load',
+            help='Prefix of generated usernames, must not be taken yet.')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.alpha = options['alpha']
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'Users prefixed "{prefix}" already exist.')
+        if not Ingredients.objects.exists():
+            call_command('load_ingredients', stdout=self.stdout)
+
+        with transaction.atomic():
+            users = self.create_users(prefix, options['users'])
+            tags = self.create_tags(options['tags'])
+        recipes = self.create_recipes(users, tags, options['recipes'])
+        with transaction.atomic():
+            self.create_pairs(
+                Subscription, 'user', users, 'author', users,
+                options['subscriptions'], distinct=True)
+            self.create_pairs(
+                Recipes.is_favorited.through, 'user', users,
+                'recipes', recipes, options['favorites'])
+            self.create_pairs(
+                Recipes.is_in_shopping_cart.through, 'user', users,
+                'recipes', recipes, options['cart'])
+            call_command('recount', stdout=self.stdout)
+            ShoppingCartIngredient.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(users)} users and {len(recipes)} recipes.'))
+
+    def create_users(self, prefix, count):
+        password = make_password('password')
+        User.objects.bulk_create(
+            (User(username=f'{prefix}{index}',
+                  email=f'{prefix}{index}@example.com',
+                  first_name=f'Name{index}', last_name=f'Surname{index}',
+                  password=password)
+             for index in range(count)),
+            batch_size=self.batch_size,
+        )
+        users = list(User.objects.filter(
+            username__startswith=prefix).order_by('id').values_list(
+                'id', flat=True))
+        UserStats.objects.bulk_create(
+            (UserStats(user_id=user) for user in users),
+            batch_size=self.batch_size, ignore_conflicts=True,
+        )
+        return users
+
+    def create_tags(self, count):
+        tags = []
+        for index in range(count):
+            tag, _ = Tag.objects.get_or_create(
+                slug=f'tag{index}',
+                defaults={'name': f'Tag {index}',
+                          'color': TAG_COLORS[index % len(TAG_COLORS)]})
+            tags.append(tag.id)
+        return tags
+
+    def create_recipes(self, users, tags, count):
+        """Insert recipes batch by batch with their ingredients and tags."""
+        ingredients = list(
+            Ingredients.objects.order_by('id').values_list('id', flat=True))
+        author_weights = zipf_weights(len(users), self.alpha)
+        recipes = []
+        while len(recipes) < count:
+            size = min(self.batch_size, count - len(recipes))
+            authors = self.rng.choices(
+                users, cum_weights=author_weights, k=size)
+            with transaction.atomic():
+                last_id = Recipes.objects.order_by('-id').values_list(
+                    'id', flat=True).first() or 0
+                Recipes.objects.bulk_create(
+                    Recipes(
+                        author_id=author,
+                        name=f'Recipe {len(recipes) + index}',
+                        text='Generated recipe.',
+                        cooking_time=self.rng.randint(5, 180),
+                        pub_date=START_DATE + timedelta(
+                            seconds=self.rng.randrange(365 * 24 * 3600)),
+                    )
+                    for index, author in enumerate(authors)
+                )
+                batch = list(Recipes.objects.filter(
+                    id__gt=last_id).order_by('id').values_list(
+                        'id', flat=True))
+                insert_rows(
+                    IngredientPerRecipe, ['recipe', 'ingredient', 'amount'],
+                    ((recipe, ingredient, self.rng.randint(1, 500))
+                     for recipe in batch
+                     for ingredient in self.rng.sample(
+                         ingredients, self.rng.randint(3, 30))),
+                    self.batch_size,
+                )
+                insert_rows(
+                    Recipes.tags.through, ['recipes', 'tag'],
+                    ((recipe, tag)
+                     for recipe in batch
+                     for tag in self.rng.sample(
+                         tags, self.rng.randint(1, min(3, len(tags))))),
+                    self.batch_size,
+                )
+            recipes.extend(batch)
+            self.stdout.write(f'{len(recipes)}/{count} recipes')
+        return recipes
+
+    def create_pairs(self, model, left_field, left, right_field, right,
+                     count, distinct=False):
+        """Insert ``count`` unique pairs drawn with a power-law skew.
+
+        Sampling stalls as the popular pairs run out, so once a round
+        adds under a tenth of the missing pairs the rest are taken in
+        rank order.
+        """
+        if not left or not right:
+            return
+        left_weights = zipf_weights(len(left), self.alpha)
+        right_weights = zipf_weights(len(right), self.alpha)
+        limit = len(left) * len(right)
+        if distinct:
+            limit -= len(set(left) & set(right))
+        target = min(count, limit)
+        pairs = set()
+        while len(pairs) < target:
+            missing = target - len(pairs)
+            before = len(pairs)
+            for pair in zip(
+                    self.rng.choices(left, cum_weights=left_weights,
+                                     k=missing),
+                    self.rng.choices(right, cum_weights=right_weights,
+                                     k=missing)):
+                if not (distinct and pair[0] == pair[1]):
+                    pairs.add(pair)
+            if len(pairs) - before < max(missing // 10, 1):
+                break
+        remaining = (
+            pair for pair in product(left, right)
+            if pair not in pairs and not (distinct and pair[0] == pair[1]))
+        pairs.update(islice(remaining, target - len(pairs)))
+        insert_rows(model, [left_field, right_field], sorted(pairs),
+                    self.batch_size)
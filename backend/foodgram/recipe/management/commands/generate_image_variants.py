@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from recipe.models import Recipes
+from recipe.thumbnails import render_variants
+
+
+class Command(BaseCommand):
+    help = 'Render missing WebP variants for every recipe image.'
+
+    def handle(self, *args, **options):
+        names = Recipes.objects.exclude(image='').exclude(
+            image__isnull=True).values_list('image', flat=True).distinct()
+        rendered = 0
+        failed = 0
+        for name in names.iterator():
+            try:
+                render_variants(name)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+            else:
+                rendered += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Variants ready for {rendered} images, {failed} failed.'))
@@ -0,0 +1,139 @@
+import csv
+import io
+import json
+import os
+import time
+from itertools import islice
+
+from api.cache import bump_catalog
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipe.models import Ingredients
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(settings.BASE_DIR), os.pardir, 'data', 'ingredients.csv')
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1]
+
+
+def read_json(file, chunk_size=64 * 1024):
+    """Decode the items of a JSON array one at a time.
+
+    Only the current chunk is held in memory, not the whole file.
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Expected a JSON array of ingredients.')
+    position = 1
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if buffer.startswith(']', position):
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise CommandError('Truncated or invalid JSON file.')
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item['name'], item['measurement_unit']
+
+
+class Command(BaseCommand):
+    help = 'Load ingredients from a .csv or .json file, skipping known ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=os.path.normpath(DEFAULT_PATH),
+            help='Path to ingredients.csv or ingredients.json.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows per INSERT, or per COPY on PostgreSQL.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        readers = {'.csv': read_csv, '.json': read_json}
+        reader = readers.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError('Only .csv and .json files are supported.')
+        started = time.perf_counter()
+        with open(path, encoding='utf-8') as file, transaction.atomic():
+            rows = (
+                (name.strip(), unit.strip()) for name, unit in reader(file)
+            )
+            if connection.vendor == 'postgresql':
+                total, inserted = self.copy(rows, options['batch_size'])
+            else:
+                total, inserted = self.insert(rows, options['batch_size'])
+            if inserted:
+                # Bulk inserts send no post_save, invalidate by hand.
+                bump_catalog('ingredients')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Inserted {inserted}, skipped {total - inserted} '
+            f'in {elapsed:.2f}s.'))
+
+    def insert(self, rows, batch_size):
+        """Insert unknown rows in batches."""
+        existing = set(
+            Ingredients.objects.values_list('name', 'measurement_unit'))
+        total = 0
+        batch = []
+        inserted = 0
+        for row in rows:
+            total += 1
+            if row in existing:
+                continue
+            existing.add(row)
+            batch.append(Ingredients(name=row[0], measurement_unit=row[1]))
+            if len(batch) == batch_size:
+                inserted += self.flush(batch)
+        inserted += self.flush(batch)
+        return total, inserted
+
+    @staticmethod
+    def flush(batch):
+        Ingredients.objects.bulk_create(batch, ignore_conflicts=True)
+        count = len(batch)
+        batch.clear()
+        return count
+
+    def copy(self, rows, batch_size):
+        """COPY rows into a staging table and merge them in one INSERT.
+
+        Rows are copied in batches, so the file is never buffered whole.
+        """
+        table = connection.ops.quote_name(Ingredients._meta.db_table)
+        total = 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredients_load '
+                '(name varchar(200), measurement_unit varchar(20)) '
+                'ON COMMIT DROP')
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(batch)
+                buffer.seek(0)
+                cursor.cursor.copy_expert(
+                    'COPY ingredients_load FROM STDIN WITH (FORMAT csv)',
+                    buffer)
+                total += len(batch)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit '
+                'FROM ingredients_load '
+                'ON CONFLICT DO NOTHING')
+            inserted = cursor.rowcount
+        return total, inserted
@@ -0,0 +1,37 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from recipe.models import Recipes
+from users.models import Subscription, UserStats
+
+User = get_user_model()
+
+
+def count_of(queryset, field):
+    """Correlated COUNT(*) of rows whose ``field`` matches the outer row."""
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(total=Count('*')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Recalculate denormalized favorites, recipes and followers counts.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            UserStats.objects.bulk_create(
+                (UserStats(user_id=user_id) for user_id in User.objects.filter(
+                    stats__isnull=True).values_list('id', flat=True)),
+                batch_size=1000,
+            )
+            recipes = Recipes.objects.update(favorites_count=count_of(
+                Recipes.is_favorited.through.objects, 'recipes'))
+            users = UserStats.objects.update(
+                recipes_count=count_of(Recipes.objects, 'author'),
+                followers_count=count_of(Subscription.objects, 'author'),
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Recounted {recipes} recipes and {users} users.'))
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:01
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicate_slugs(apps, schema_editor):
+    """Suffix repeated slugs with the tag id, keeping the oldest tag's."""
+    Tag = apps.get_model('recipe', 'Tag')
+    max_length = Tag._meta.get_field('slug').max_length
+    duplicates = Tag.objects.order_by().values('slug').annotate(
+        total=Count('id')).filter(total__gt=1).values_list('slug', flat=True)
+    for tag in Tag.objects.filter(slug__in=list(duplicates)).order_by('id'):
+        if Tag.objects.filter(slug=tag.slug, id__lt=tag.id).exists():
+            suffix = f'-{tag.id}'
+            tag.slug = tag.slug[:max_length - len(suffix)] + suffix
+            tag.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0011_recipes_pub_date_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_slugs,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+    ]
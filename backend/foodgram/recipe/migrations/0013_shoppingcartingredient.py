@@ -0,0 +1,54 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_shopping_cart_ingredients(apps, schema_editor):
+    Recipes = apps.get_model('recipe', 'Recipes')
+    ShoppingCartIngredient = apps.get_model('recipe', 'ShoppingCartIngredient')
+    totals = Recipes.is_in_shopping_cart.through.objects.filter(
+        recipes__ingredientperrecipe__isnull=False
+    ).values_list(
+        'user_id', 'recipes__ingredientperrecipe__ingredient_id'
+    ).annotate(
+        total=Sum('recipes__ingredientperrecipe__amount')
+    ).order_by()
+    ShoppingCartIngredient.objects.bulk_create(
+        (ShoppingCartIngredient(user_id=user, ingredient_id=ingredient,
+                                amount=total)
+         for user, ingredient, total in totals.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipe', '0012_tag_slug_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartIngredient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(verbose_name='Вес/объем')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipe.ingredients', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_ingredients', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингредиенты в корзине',
+                'verbose_name_plural': 'Ингредиенты в корзине',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcartingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique cart ingredient'),
+        ),
+        migrations.RunPython(fill_shopping_cart_ingredients,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.19 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0013_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='image_variants_ready',
+            field=models.BooleanField(default=False, verbose_name='Варианты фото готовы'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:08
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_favorites(apps, schema_editor):
+    Recipes = apps.get_model('recipe', 'Recipes')
+    favorites = Recipes.is_favorited.through.objects.filter(
+        recipes=OuterRef('pk')
+    ).order_by().values('recipes').annotate(total=Count('*')).values('total')
+    Recipes.objects.update(favorites_count=Coalesce(Subquery(favorites), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0014_recipes_image_variants_ready'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В избранном'),
+        ),
+        migrations.RunPython(count_favorites, migrations.RunPython.noop),
+    ]
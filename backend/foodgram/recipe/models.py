@@ -1,5 +1,6 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import connections, models
+from django.db.models import Sum
 from django.utils import timezone
 
 from .validators import color_validator
@@ -11,7 +12,7 @@ class Tag(models.Model):
     name = models.CharField(max_length=20, verbose_name='Тэг')
     color = models.CharField(max_length=7, validators=[color_validator],
                              verbose_name='Цвет')
-    slug = models.SlugField()
+    slug = models.SlugField(unique=True)
 
     class Meta:
         verbose_name = 'Тэг'
@@ -68,16 +69,41 @@ class Recipes(models.Model):
     cooking_time = models.PositiveSmallIntegerField(verbose_name='Время')
     pub_date = models.DateTimeField(default=timezone.now,
                                     verbose_name='Дата создания')
+    favorites_count = models.PositiveIntegerField(
+        default=0, verbose_name='В избранном')
+    image_variants_ready = models.BooleanField(
+        default=False, verbose_name='Варианты фото готовы')
 
     class Meta:
         ordering = ['-id']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """Leave fields moved by queryset updates out of full saves.
+
+        favorites_count is only moved with F() updates and
+        image_variants_ready by the image workers, writing back the
+        loaded values would undo concurrent changes.
+        """
+        if (not self._state.adding and not kwargs.get('force_insert')
+                and kwargs.get('update_fields') is None):
+            skipped = self.get_deferred_fields() | {
+                'favorites_count', 'image_variants_ready'}
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skipped
+            ]
+        super().save(*args, **kwargs)
+
 
 class IngredientPerRecipe(models.Model):
     ingredient = models.ForeignKey(
@@ -106,3 +132,124 @@ class IngredientPerRecipe(models.Model):
 
     def __str__(self):
         return str(self.recipe)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the loaded row to adjust cart totals on save."""
+        instance = super().from_db(db, field_names, values)
+        instance.loaded = instance.cart_row()
+        return instance
+
+    def cart_row(self):
+        """The (recipe, ingredient, amount) this row adds to carts."""
+        return tuple(self.__dict__.get(field)
+                     for field in ('recipe_id', 'ingredient_id', 'amount'))
+
+
+class ShoppingCartIngredientManager(models.Manager):
+
+    def live_totals(self, users=None):
+        """Aggregate cart totals from the recipes currently in carts."""
+        cart = Recipes.is_in_shopping_cart.through.objects.all()
+        if users is not None:
+            cart = cart.filter(user__in=users)
+        return cart.filter(
+            recipes__ingredientperrecipe__isnull=False
+        ).values_list(
+            'user_id', 'recipes__ingredientperrecipe__ingredient_id'
+        ).annotate(
+            total=Sum('recipes__ingredientperrecipe__amount')
+        ).order_by()
+
+    def upsert(self, select, params):
+        """Add the (user, ingredient, amount) rows of ``select`` to totals.
+
+        A single INSERT ... ON CONFLICT statement, supported by both
+        PostgreSQL and SQLite, instead of one UPDATE per ingredient.
+        """
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        user, ingredient, amount = (
+            quote(self.model._meta.get_field(name).column)
+            for name in ('user', 'ingredient', 'amount'))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({user}, {ingredient}, {amount}) '
+                f'{select} ON CONFLICT ({user}, {ingredient}) DO UPDATE '
+                f'SET {amount} = {table}.{amount} + EXCLUDED.{amount}',
+                params)
+
+    def apply_recipes(self, recipes, users, sign=1):
+        """Add (sign=1) or subtract (sign=-1) ingredients of the recipes."""
+        recipes = [getattr(recipe, 'pk', recipe) for recipe in recipes]
+        users = list(users)
+        if not recipes or not users:
+            return
+        quote = connections[self.db].ops.quote_name
+        user_id = quote(User._meta.pk.column)
+        self.upsert(
+            f'SELECT u.{user_id}, r.ingredient_id, SUM(r.amount) * %s '
+            f'FROM {quote(User._meta.db_table)} u, '
+            f'{quote(IngredientPerRecipe._meta.db_table)} r '
+            f'WHERE u.{user_id} IN ({", ".join(["%s"] * len(users))}) '
+            f'AND r.recipe_id IN ({", ".join(["%s"] * len(recipes))}) '
+            f'GROUP BY u.{user_id}, r.ingredient_id',
+            [sign, *users, *recipes])
+        if sign < 0:
+            self.filter(user__in=users, amount__lte=0).delete()
+
+    def apply_ingredient(self, recipe, ingredient, amount):
+        """Change one ingredient of a recipe in every cart holding it."""
+        if not amount:
+            return
+        cart = Recipes.is_in_shopping_cart.through
+        self.upsert(
+            f'SELECT user_id, %s, %s FROM '
+            f'{connections[self.db].ops.quote_name(cart._meta.db_table)} '
+            f'WHERE recipes_id = %s',
+            [ingredient, amount, recipe])
+        if amount < 0:
+            self.filter(
+                user__in=cart.objects.filter(recipes=recipe).values('user'),
+                amount__lte=0,
+            ).delete()
+
+    def rebuild(self):
+        """Recreate every total from the live join."""
+        self.all().delete()
+        self.bulk_create(
+            (self.model(user_id=user, ingredient_id=ingredient, amount=total)
+             for user, ingredient, total in self.live_totals().iterator()),
+            batch_size=1000,
+        )
+
+
+class ShoppingCartIngredient(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredients,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    amount = models.IntegerField(
+        verbose_name='Вес/объем',
+    )
+
+    objects = ShoppingCartIngredientManager()
+
+    class Meta:
+        verbose_name = 'Ингредиенты в корзине'
+        verbose_name_plural = 'Ингредиенты в корзине'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'ingredient'],
+                                    name='unique cart ingredient')
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient}'
@@ -0,0 +1,148 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from .models import IngredientPerRecipe, Recipes, ShoppingCartIngredient
+
+Cart = Recipes.is_in_shopping_cart.through
+Favorite = Recipes.is_favorited.through
+User = get_user_model()
+
+# Recipes whose cart totals are adjusted once for a whole batch of
+# ingredient row changes, so the per-row handlers below stand aside.
+batched_recipes = ContextVar('batched_recipes', default=frozenset())
+
+
+@contextmanager
+def cart_rows_batched(recipe_id):
+    """Skip per-row cart total updates for one recipe inside the block."""
+    token = batched_recipes.set(batched_recipes.get() | {recipe_id})
+    try:
+        yield
+    finally:
+        batched_recipes.reset(token)
+
+
+def is_batched(row):
+    return row.recipe_id in batched_recipes.get()
+
+
+def count_favorites(recipes, change):
+    """Add change to favorites_count, never going below zero."""
+    queryset = Recipes.objects.filter(pk__in=recipes)
+    if change < 0:
+        queryset = queryset.filter(favorites_count__gte=-change)
+    queryset.update(favorites_count=F('favorites_count') + change)
+
+
+def move_cart_row(previous, current):
+    """Replace one (recipe, ingredient, amount) row in the cart totals."""
+    totals = ShoppingCartIngredient.objects
+    if previous and current and previous[:2] == current[:2]:
+        totals.apply_ingredient(*current[:2], current[2] - previous[2])
+        return
+    if previous:
+        totals.apply_ingredient(*previous[:2], -previous[2])
+    if current:
+        totals.apply_ingredient(*current)
+
+
+def delete_recipe(recipe):
+    """Delete a recipe without per-row updates for its ingredients.
+
+    take_out_of_carts() leaves the cascaded ingredient rows no cart to
+    adjust. Cascades from elsewhere, such as deleting the author, still
+    run the per-row handlers, which then find no cart.
+    """
+    with cart_rows_batched(recipe.pk):
+        return recipe.delete()
+
+
+@receiver(pre_delete, sender=Recipes, dispatch_uid='cart_recipe_delete')
+def take_out_of_carts(sender, instance, **kwargs):
+    links = Cart.objects.filter(recipes=instance)
+    ShoppingCartIngredient.objects.apply_recipes(
+        [instance], links.values_list('user_id', flat=True), sign=-1)
+    links.delete()
+
+
+@receiver(pre_save, sender=IngredientPerRecipe,
+          dispatch_uid='cart_row_pre_save')
+def load_cart_row(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None or is_batched(instance):
+        return
+    if None in getattr(instance, 'loaded', (None,)):
+        instance.loaded = sender.objects.filter(pk=instance.pk).values_list(
+            'recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientPerRecipe,
+          dispatch_uid='cart_row_post_save')
+def save_cart_row(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else getattr(instance, 'loaded', None)
+    instance.loaded = instance.cart_row()
+    if not is_batched(instance):
+        move_cart_row(previous, instance.loaded)
+
+
+@receiver(post_delete, sender=IngredientPerRecipe,
+          dispatch_uid='cart_row_post_delete')
+def delete_cart_row(sender, instance, **kwargs):
+    if is_batched(instance):
+        return
+    move_cart_row(getattr(instance, 'loaded', None) or instance.cart_row(),
+                  None)
+
+
+def changed_links(sender, instance, action, reverse, pk_set):
+    """Recipes, users and sign of an m2m manager change, or None."""
+    if reverse:
+        field, other = 'user', 'recipes_id'
+    else:
+        field, other = 'recipes', 'user_id'
+    if action in ('pre_remove', 'pre_clear'):
+        links = sender.objects.filter(**{field: instance})
+        if pk_set is not None:
+            links = links.filter(**{f'{other}__in': pk_set})
+        pk_set = set(links.values_list(other, flat=True))
+        sign = -1
+    elif action == 'post_add':
+        sign = 1
+    else:
+        return None
+    if not pk_set:
+        return None
+    if reverse:
+        return pk_set, [instance.pk], sign
+    return [instance.pk], pk_set, sign
+
+
+@receiver(m2m_changed, sender=Cart, dispatch_uid='cart_links_changed')
+def change_cart_links(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep totals right when carts are edited through the m2m manager."""
+    changed = changed_links(sender, instance, action, reverse, pk_set)
+    if changed:
+        ShoppingCartIngredient.objects.apply_recipes(*changed)
+
+
+@receiver(m2m_changed, sender=Favorite, dispatch_uid='favorites_changed')
+def change_favorites(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep favorites_count right for m2m manager and admin edits."""
+    changed = changed_links(sender, instance, action, reverse, pk_set)
+    if changed:
+        recipes, users, sign = changed
+        count_favorites(recipes, sign * len(users))
+
+
+@receiver(pre_delete, sender=User, dispatch_uid='favorites_user_delete')
+def forget_user_favorites(sender, instance, **kwargs):
+    # The cascade deletes the links without any m2m_changed signal.
+    count_favorites(
+        Favorite.objects.filter(user=instance).values('recipes_id'), -1)
@@ -0,0 +1,119 @@
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image, ImageOps
+
+from .models import Recipes
+
+UPLOAD_TO = Recipes._meta.get_field('image').upload_to
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_WORKERS, thread_name_prefix='images')
+slots = BoundedSemaphore(settings.IMAGE_QUEUE_SIZE)
+pending = set()
+pending_lock = Lock()
+
+
+def variant_name(name, variant):
+    """Return the storage name of an image variant."""
+    directory, filename = os.path.split(name)
+    base = os.path.splitext(filename)[0]
+    return f'{directory}/{variant}/{base}.webp'
+
+
+def variant_names(name):
+    """Return storage names of every configured variant of an image."""
+    return {
+        variant: variant_name(name, variant)
+        for variant in settings.RECIPE_IMAGE_VARIANTS
+    }
+
+
+def mark_ready(name):
+    """Flag the recipes showing an image as having all its variants."""
+    Recipes.objects.filter(image=name).update(image_variants_ready=True)
+
+
+def render_variants(name):
+    """Create missing WebP variants of a stored image."""
+    with default_storage.open(name) as file:
+        original = Image.open(file)
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA')
+    for variant, options in settings.RECIPE_IMAGE_VARIANTS.items():
+        target = variant_name(name, variant)
+        if default_storage.exists(target):
+            continue
+        if options['crop']:
+            image = ImageOps.fit(original, options['size'])
+        else:
+            image = original.copy()
+            image.thumbnail(options['size'])
+        buffer = io.BytesIO()
+        image.save(buffer, 'WEBP', quality=settings.IMAGE_WEBP_QUALITY)
+        default_storage.save(target, ContentFile(buffer.getvalue()))
+    mark_ready(name)
+
+
+def run_in_slot(name):
+    try:
+        render_variants(name)
+    except Exception:
+        logger.exception('Variants of %s failed.', name)
+    finally:
+        connection.close()
+        with pending_lock:
+            pending.discard(name)
+        slots.release()
+
+
+def schedule_variants(name):
+    """Render variants on the worker pool.
+
+    When the queue is full the job is dropped rather than rendered in
+    the request; generate_image_variants renders what is missing.
+    """
+    if not slots.acquire(blocking=False):
+        logger.warning('Image queue full, variants of %s skipped.', name)
+        return
+    with pending_lock:
+        if name in pending:
+            slots.release()
+            return
+        pending.add(name)
+    executor.submit(run_in_slot, name)
+
+
+def image_name(file):
+    """Return the storage name of an image, derived from its content."""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    extension = os.path.splitext(file.name)[1].lower()
+    return f'{UPLOAD_TO}{digest.hexdigest()}{extension}'
+
+
+def store_image(name, file):
+    """Store an image under ``name`` and schedule its variants.
+
+    Identical uploads share one file, which is written only once.
+    """
+    if not default_storage.exists(name):
+        file.seek(0)
+        default_storage.save(name, file)
+    if all(default_storage.exists(target)
+           for target in variant_names(name).values()):
+        mark_ready(name)
+    else:
+        schedule_variants(name)
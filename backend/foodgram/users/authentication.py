@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from api.metrics import CACHE_REQUESTS, registry
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+CACHE_PREFIX = 'auth:token:'
+PROCESS_CACHES = (DummyCache, LocMemCache)
+
+local_tokens = OrderedDict()
+local_lock = Lock()
+
+
+def get_shared_cache():
+    """Return the shared cache used for tokens, if one is configured.
+
+    Per-process backends are skipped: forget() could not evict a token
+    from the copies other workers keep.
+    """
+    alias = settings.AUTH_TOKEN_CACHE
+    if not alias:
+        return None
+    shared = caches[alias]
+    if isinstance(shared, PROCESS_CACHES):
+        return None
+    return shared
+
+
+def remember(key, credentials):
+    """Put credentials into the local LRU, evicting the oldest entry."""
+    with local_lock:
+        local_tokens[key] = (credentials, time.monotonic()
+                             + settings.AUTH_TOKEN_LOCAL_TTL)
+        local_tokens.move_to_end(key)
+        while len(local_tokens) > settings.AUTH_TOKEN_LOCAL_SIZE:
+            local_tokens.popitem(last=False)
+
+
+def recall(key):
+    """Return unexpired credentials from the local LRU."""
+    with local_lock:
+        entry = local_tokens.get(key)
+        if entry is None:
+            return None
+        credentials, expires = entry
+        if expires < time.monotonic():
+            del local_tokens[key]
+            return None
+        local_tokens.move_to_end(key)
+        return credentials
+
+
+def forget(key):
+    """Drop a token from the local LRU and the shared cache."""
+    with local_lock:
+        local_tokens.pop(key, None)
+    shared = get_shared_cache()
+    if shared is not None:
+        shared.delete(CACHE_PREFIX + key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication backed by a local LRU and the shared cache.
+
+    Local entries live for AUTH_TOKEN_LOCAL_TTL seconds. Evictions reach
+    the shared cache at once, so other processes pick them up within
+    that time; without a cross-process cache only the LRU is used.
+    """
+
+    def authenticate_credentials(self, key):
+        credentials = recall(key)
+        if credentials is not None:
+            registry.count(CACHE_REQUESTS, ('tokens', 'local_hit'))
+        else:
+            shared = get_shared_cache()
+            if shared is not None:
+                credentials = shared.get(CACHE_PREFIX + key)
+            if credentials is not None:
+                registry.count(CACHE_REQUESTS, ('tokens', 'shared_hit'))
+            else:
+                registry.count(CACHE_REQUESTS, ('tokens', 'miss'))
+                credentials = super().authenticate_credentials(key)
+                if shared is not None:
+                    shared.set(CACHE_PREFIX + key, credentials,
+                               settings.AUTH_TOKEN_CACHE_TTL)
+            remember(key, credentials)
+        user, token = credentials
+        if not user.is_active:
+            forget(key)
+            raise AuthenticationFailed('User inactive or deleted.')
+        return credentials
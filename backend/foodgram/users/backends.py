@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models.functions import Lower
+
+User = get_user_model()
+
+
+class EmailBackend(ModelBackend):
+    """Authenticate users by a case-insensitive email and password."""
+
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if not isinstance(email, str) or not isinstance(password, str):
+            return None
+        user = User.objects.annotate(
+            email_lower=Lower('email')
+        ).filter(
+            email_lower=email.lower()
+        ).select_related('auth_token').order_by('id').first()
+        if user is None:
+            # Run the hasher anyway so that unknown emails take as long
+            # as wrong passwords.
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(
+                user):
+            return user
+        return None
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:08
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_subscriptions(apps, schema_editor):
+    Subscription = apps.get_model('users', 'Subscription')
+    keep = Subscription.objects.values('user', 'author').annotate(
+        keep_id=Min('id')).values('keep_id')
+    Subscription.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_auto_20230521_2023'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_subscriptions,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='subscription',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique subscription'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.19 on 2026-10-18 18:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_user_stats(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Recipes = apps.get_model('recipe', 'Recipes')
+    Subscription = apps.get_model('users', 'Subscription')
+    UserStats = apps.get_model('users', 'UserStats')
+    UserStats.objects.bulk_create(
+        (UserStats(user_id=user_id)
+         for user_id in User.objects.values_list('id', flat=True)),
+        batch_size=1000,
+    )
+    recipes = Recipes.objects.filter(
+        author=OuterRef('user')
+    ).order_by().values('author').annotate(total=Count('*')).values('total')
+    followers = Subscription.objects.filter(
+        author=OuterRef('user')
+    ).order_by().values('author').annotate(total=Count('*')).values('total')
+    UserStats.objects.update(
+        recipes_count=Coalesce(Subquery(recipes), 0),
+        followers_count=Coalesce(Subquery(followers), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipe', '0015_recipes_favorites_count'),
+        ('users', '0004_subscription_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('recipes_count', models.PositiveIntegerField(default=0)),
+                ('followers_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_user_stats, migrations.RunPython.noop),
+    ]
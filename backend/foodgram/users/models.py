@@ -1,5 +1,6 @@
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import F
 
 User = get_user_model()
 
@@ -10,3 +11,29 @@ class Subscription(models.Model):
     author = models.ForeignKey(User,
                                null=False, related_name='followed_user',
                                on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'],
+                                    name='unique subscription')
+        ]
+
+
+class UserStatsManager(models.Manager):
+
+    def increment(self, users, field, delta=1):
+        """Atomically change a counter of the given users."""
+        queryset = self.filter(user__in=users)
+        if delta < 0:
+            queryset = queryset.filter(**{f'{field}__gte': -delta})
+        queryset.update(**{field: F(field) + delta})
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(
+        User, primary_key=True, related_name='stats',
+        on_delete=models.CASCADE)
+    recipes_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+
+    objects = UserStatsManager()
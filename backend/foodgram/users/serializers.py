@@ -19,12 +19,18 @@ class UserSerializer(serializers.ModelSerializer):
     def get_is_subscribed(self, obj):
         """Return subscription status."""
         user = self.context['request'].user
-        if user.is_authenticated:
-            user = self.context['request'].user
-            author = obj
-            return Subscription.objects.filter(
-                user=user, author=author).exists()
-        return None
+        if not user.is_authenticated:
+            return None
+        return obj.id in self.get_subscriptions(user)
+
+    def get_subscriptions(self, user):
+        """Load followed author ids once per serializer context."""
+        if 'subscriptions' not in self.context:
+            self.context['subscriptions'] = set(
+                Subscription.objects.filter(user=user).values_list(
+                    'author_id', flat=True)
+            )
+        return self.context['subscriptions']
 
     def create(self, validated_data):
         """Create new Users."""
@@ -0,0 +1,60 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from recipe.models import Recipes
+from rest_framework.authtoken.models import Token
+
+from .authentication import forget
+from .models import Subscription, UserStats
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User, dispatch_uid='user_stats_create')
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Recipes, dispatch_uid='recipes_count_save')
+def count_created_recipe(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.increment([instance.author_id], 'recipes_count')
+
+
+@receiver(post_delete, sender=Recipes, dispatch_uid='recipes_count_delete')
+def count_deleted_recipe(sender, instance, **kwargs):
+    UserStats.objects.increment([instance.author_id], 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Subscription,
+          dispatch_uid='followers_count_save')
+def count_created_subscription(sender, instance, created, raw=False,
+                               **kwargs):
+    if created and not raw:
+        UserStats.objects.increment([instance.author_id], 'followers_count')
+
+
+@receiver(post_delete, sender=Subscription,
+          dispatch_uid='followers_count_delete')
+def count_deleted_subscription(sender, instance, **kwargs):
+    UserStats.objects.increment(
+        [instance.author_id], 'followers_count', -1)
+
+
+@receiver(post_delete, sender=Token, dispatch_uid='token_cache_delete')
+def forget_deleted_token(sender, instance, **kwargs):
+    # Evicting earlier would let a concurrent request cache the token
+    # again before the delete commits.
+    transaction.on_commit(partial(forget, instance.key))
+
+
+@receiver(post_save, sender=User, dispatch_uid='token_cache_user_save')
+def forget_user_tokens(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        for key in Token.objects.filter(user=instance).values_list(
+                'key', flat=True):
+            transaction.on_commit(partial(forget, key))
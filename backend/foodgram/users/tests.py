@@ -0,0 +1,205 @@
+import tempfile
+from datetime import timedelta
+
+from api import metrics
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from recipe.models import Recipes
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient, APIRequestFactory
+
+from .authentication import (CachedTokenAuthentication, get_shared_cache,
+                             local_tokens)
+from .models import Subscription
+
+User = get_user_model()
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Token lookups are served from the caches once warm."""
+
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+        self.addCleanup(local_tokens.clear)
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password')
+        self.token = Token.objects.create(user=self.user)
+
+    def authenticate(self):
+        request = APIRequestFactory().get(
+            '/api/users/me/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        return CachedTokenAuthentication().authenticate(request)
+
+    def test_warm_cache_runs_no_auth_queries(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate()
+        self.assertEqual(user, self.user)
+
+    def test_hits_are_published(self):
+        key = (metrics.CACHE_REQUESTS, ('tokens', 'local_hit'))
+        before = metrics.registry.counters.get(key, 0)
+        self.authenticate()
+        self.authenticate()
+        self.assertEqual(metrics.registry.counters[key], before + 1)
+        self.assertIn('foodgram_cache_requests_total'
+                      '{cache="tokens",result="local_hit"}', metrics.render())
+
+    def test_shared_cache_outlives_local_entries(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': directory.name}})
+        shared.enable()
+        self.addCleanup(shared.disable)
+        self.authenticate()
+        local_tokens.clear()
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+    def test_deleted_token_is_rejected(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_eviction_waits_for_commit(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.is_active = False
+            self.user.save()
+            self.assertIn(self.token.key, local_tokens)
+        for callback in callbacks:
+            callback()
+        self.assertNotIn(self.token.key, local_tokens)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_is_not_shared(self):
+        self.assertIsNone(get_shared_cache())
+
+
+class TokenLoginTests(TestCase):
+    """Logins by email reject malformed credentials with 400."""
+
+    def setUp(self):
+        User.objects.create_user(
+            username='user', email='User@example.com', password='password')
+
+    def login(self, data):
+        return self.client.post('/api/auth/token/login/', data,
+                                content_type='application/json')
+
+    def test_email_is_case_insensitive(self):
+        response = self.login(
+            {'email': 'user@EXAMPLE.com', 'password': 'password'})
+        self.assertEqual(response.status_code, 201)
+
+    def test_non_string_credentials_are_rejected(self):
+        for data in ({'email': 5, 'password': 'password'},
+                     {'email': 'user@example.com', 'password': ['x']},
+                     {'email': None, 'password': None}):
+            with self.subTest(data=data), self.assertNumQueries(0):
+                self.assertEqual(self.login(data).status_code, 400)
+
+
+class SubscriptionsTests(TestCase):
+    """Followed authors come with their latest recipes and counters."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, *cls.authors = [
+            User.objects.create_user(
+                username=f'user{i}', email=f'user{i}@example.com',
+                password='password')
+            for i in range(3)
+        ]
+        now = timezone.now()
+        # The last recipe created is the oldest, so ids do not give the
+        # order.
+        for author in cls.authors:
+            for i, minutes in enumerate((4, 3, 2, 1, 5)):
+                Recipes.objects.create(
+                    author=author, name=f'{author.username} {i}',
+                    text='Text', cooking_time=5,
+                    pub_date=now - timedelta(minutes=minutes))
+        for author in cls.authors:
+            Subscription.objects.create(user=cls.user, author=author)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_recipes_limit_keeps_latest(self):
+        response = self.client.get(
+            '/api/users/subscriptions/?recipes_limit=2')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([author['id'] for author in results],
+                         [author.id for author in reversed(self.authors)])
+        for author in results:
+            self.assertEqual(
+                [recipe['name'] for recipe in author['recipes']],
+                [f'{author["username"]} 3', f'{author["username"]} 2'])
+            self.assertEqual(author['recipes_count'], 5)
+            self.assertTrue(author['is_subscribed'])
+
+    def test_without_limit_lists_every_recipe(self):
+        response = self.client.get('/api/users/subscriptions/')
+        for author in response.data['results']:
+            self.assertEqual(len(author['recipes']), 5)
+
+    def test_recipes_count_follows_deletes(self):
+        Recipes.objects.filter(author=self.authors[0]).first().delete()
+        response = self.client.get('/api/users/subscriptions/')
+        counts = {author['id']: author['recipes_count']
+                  for author in response.data['results']}
+        self.assertEqual(counts, {self.authors[0].id: 4,
+                                  self.authors[1].id: 5})
+
+
+class SubscribeTests(TestCase):
+    """Subscribing twice or to oneself is rejected."""
+
+    def setUp(self):
+        self.user, self.author = [
+            User.objects.create_user(
+                username=f'user{i}', email=f'user{i}@example.com',
+                password='password')
+            for i in range(2)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def subscribe(self, author, method='post'):
+        return getattr(self.client, method)(
+            f'/api/users/{author.id}/subscribe/')
+
+    def test_duplicate_subscription(self):
+        self.assertEqual(self.subscribe(self.author).status_code, 201)
+        response = self.subscribe(self.author)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'], 'Already subscribed')
+        self.assertEqual(Subscription.objects.count(), 1)
+        self.author.stats.refresh_from_db()
+        self.assertEqual(self.author.stats.followers_count, 1)
+
+    def test_self_subscription(self):
+        response = self.subscribe(self.user)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_unsubscribe_twice(self):
+        self.subscribe(self.author)
+        self.assertEqual(
+            self.subscribe(self.author, 'delete').status_code, 204)
+        self.assertEqual(
+            self.subscribe(self.author, 'delete').status_code, 400)
+        self.author.stats.refresh_from_db()
+        self.assertEqual(self.author.stats.followers_count, 0)
@@ -1,5 +1,8 @@
-from api.serializers import RecipeSerializer, UserSerializer
+from api.pagination import SubscriptionPagination
+from api.serializers import SubscriptionSerializer, UserSerializer
 from django.contrib.auth import authenticate, get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Prefetch, Subquery
 from recipe.models import Recipes
 from rest_framework import generics, status, viewsets
 from rest_framework.authtoken.models import Token
@@ -15,6 +18,28 @@ from .serializers import ChangePasswordSerializer, CurrentUserSerializer
 User = get_user_model()
 
 
+def subscriptions_with_recipes(request):
+    """Build the queryset of the viewer's subscriptions.
+
+    Authors come with their counters and latest recipes, capped by the
+    ``recipes_limit`` query parameter.
+    """
+    recipes = Recipes.objects.only(
+        'id', 'name', 'image', 'cooking_time', 'author_id'
+    ).order_by('-pub_date', '-id')
+    recipes_limit = request.query_params.get('recipes_limit')
+    if recipes_limit and recipes_limit.isdigit():
+        latest = Recipes.objects.filter(
+            author=OuterRef('author')
+        ).order_by('-pub_date', '-id').values('id')[:int(recipes_limit)]
+        recipes = recipes.filter(id__in=Subquery(latest))
+    return Subscription.objects.filter(
+        user=request.user
+    ).select_related('author__stats').prefetch_related(
+        Prefetch('author__recipes', queryset=recipes)
+    ).order_by('-id')
+
+
 class UserViewSet(viewsets.ModelViewSet):
     """Handle user-related actions."""
 
@@ -22,98 +47,54 @@ class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     permission_classes = [AllowAny]
 
-    @action(detail=True, methods=['POST', 'DELETE'])
+    @action(detail=True, methods=['POST', 'DELETE'],
+            permission_classes=[IsAuthenticated])
     def subscribe(self, request, pk=None):
         """Handle subscription-related actions."""
         user = request.user
         author = self.get_object()
         if request.method == 'POST':
-            if Subscription.objects.filter(user=user, author=author).exists():
-                return Response(
-                    {'errors': 'Already subscribed'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
             if user == author:
                 return Response(
                     {'errors': 'Cannot subscribe to yourself'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-
-            Subscription.objects.create(user=user, author=author)
-            recipes = author.recipes.all()
-
-            user_serializer = UserSerializer(
-                author, context={'request': request})
-            recipes_serializer = RecipeSerializer(
-                recipes, context={'request': request}, many=True)
-
-            selected_fields = ['id', 'name', 'image', 'cooking_time']
-            recipes_data = recipes_serializer.data
-            selected_recipes_data = [
-                {field: recipe_data[field] for field in selected_fields}
-                for recipe_data in recipes_data
-            ]
-            data = {
-                'email': user_serializer.data['email'],
-                'id': user_serializer.data['id'],
-                'username': user_serializer.data['username'],
-                'first_name': user_serializer.data['first_name'],
-                'last_name': user_serializer.data['last_name'],
-                'recipes': selected_recipes_data,
-                'recipes_count': recipes.count()
-            }
-            return Response(data=data, status=status.HTTP_201_CREATED)
-
-        if request.method == 'DELETE':
-            if not Subscription.objects.filter(
-                    user=user, author=author).exists():
+            try:
+                with transaction.atomic():
+                    subscription = Subscription.objects.create(
+                        user=user, author=author)
+            except IntegrityError:
                 return Response(
-                    {'errors': 'Subscription not found'},
+                    {'errors': 'Already subscribed'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            Subscription.objects.filter(user=user, author=author).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-
-
-class FollowingListView(APIView):
+            subscription = subscriptions_with_recipes(request).get(
+                pk=subscription.pk)
+            serializer = SubscriptionSerializer(
+                subscription, context={'request': request})
+            return Response(
+                data=serializer.data, status=status.HTTP_201_CREATED)
+
+        deleted, _ = Subscription.objects.filter(
+            user=user, author=author).delete()
+        if not deleted:
+            return Response(
+                {'errors': 'Subscription not found'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class FollowingListView(generics.ListAPIView):
     """Handle subscription-related actions."""
 
     permission_classes = [IsAuthenticated]
+    serializer_class = SubscriptionSerializer
+    pagination_class = SubscriptionPagination
 
-    def get(self, request):
-        """Get all followed authors."""
-        user = request.user
-        subscriptions = Subscription.objects.filter(user=user)
-
-        subscribed_authors_data = []
-        for subscription in subscriptions:
-            author = subscription.author
-            author_data = {
-                'email': author.email,
-                'id': author.id,
-                'username': author.username,
-                'first_name': author.first_name,
-                'last_name': author.last_name,
-                'is_subscribed': True,
-            }
-            recipes = Recipes.objects.filter(author=author)
-            recipe_data = []
-            for recipe in recipes:
-                recipe_data.append({
-                    'id': recipe.id,
-                    'name': recipe.name,
-                    'image': recipe.image.url,
-                    'cooking_time': recipe.cooking_time,
-                })
-            author_data['recipes'] = recipe_data
-            author_data['recipes_count'] = len(recipe_data)
-            subscribed_authors_data.append(author_data)
-
-        data = {
-            'results': subscribed_authors_data,
-        }
-        return Response(data=data, status=status.HTTP_200_OK)
+    def get_queryset(self):
+        """Get followed authors with a limited number of their recipes."""
+        return subscriptions_with_recipes(self.request)
 
 
 class CurrentUserView(APIView):
@@ -168,16 +149,18 @@ class CustomAuthToken(ObtainAuthToken):
         """Request a new token."""
         email = request.data.get('email')
         password = request.data.get('password')
-        user = User.objects.get(email=email)
-        username = user.username
-
-        if email and password:
-            user = authenticate(request, username=username, password=password)
-
-            if user is not None:
-                token, created = Token.objects.get_or_create(user=user)
-            return Response({'auth_token': token.key}, status=201)
-        return Response({'error': 'Invalid name/password'}, status=400)
+        user = authenticate(request, email=email, password=password)
+        if user is None:
+            return Response({'error': 'Invalid name/password'}, status=400)
+        try:
+            token = user.auth_token
+        except Token.DoesNotExist:
+            try:
+                with transaction.atomic():
+                    token = Token.objects.create(user=user)
+            except IntegrityError:
+                token = Token.objects.get(user=user)
+        return Response({'auth_token': token.key}, status=201)
 
 
 class DeleteTokenView(APIView):